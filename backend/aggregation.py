@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import random
+import re
+
+# Statements whose word sets overlap at least this much (Jaccard) are merged into one
+COMBINE_DEDUPE_SIMILARITY = float(os.environ.get("COMBINE_DEDUPE_SIMILARITY", "0.6"))
+# Distinct statements per field sent to the model, most supported first
+COMBINE_MAX_STATEMENTS = int(os.environ.get("COMBINE_MAX_STATEMENTS", "8"))
+
+# Bump whenever the summary format or the combine prompt changes: it is part of
+# the input hash, so memoized results from older prompts stop matching
+COMBINE_PROMPT_VERSION = "1"
+
+STATEMENT_FIELDS = ("first_impression", "reason", "likes", "dislikes", "keep", "change")
+
+_WORD = re.compile(r"[a-z0-9']{3,}")
+
+
+def _text(value):
+    return " ".join(str(value or "").split())
+
+
+def _swipe(feedback):
+    swipe = feedback.get("swipe")
+    if swipe in ("left", "right"):
+        return swipe
+    # Feedback items in the frontend's shape
+    if "isSwipeRight" in feedback:
+        return "right" if feedback["isSwipeRight"] else "left"
+    return None
+
+
+def _normalize(feedback):
+    """
+    Canonical form of one feedback item: only the fields that reach the prompt,
+    whitespace-normalized. Verdict text summaries (`content`) are used only when
+    the structured fields are missing.
+    """
+    statements = {field: _text(feedback.get(field)) for field in STATEMENT_FIELDS}
+    if not any(statements.values()):
+        statements["reason"] = _text(feedback.get("content"))
+    scores = feedback.get("scores")
+    scores = {
+        str(k): v for k, v in (scores.items() if isinstance(scores, dict) else ())
+        if isinstance(v, (int, float)) and not isinstance(v, bool)
+    }
+    return {"swipe": _swipe(feedback), "scores": dict(sorted(scores.items())), **statements}
+
+
+def _similar(a, b):
+    if not a or not b:
+        return False
+    return len(a & b) / len(a | b) >= COMBINE_DEDUPE_SIMILARITY
+
+
+def _cluster(items, rng):
+    """
+    Merge near-identical statements. `items` are (text, swipe) pairs in canonical
+    order; the first text of a cluster represents it. Clusters come back ordered
+    by support, ties broken by `rng` so no judge's wording is always listed first.
+    """
+    clusters = []
+    for text, swipe in items:
+        words = set(_WORD.findall(text.lower()))
+        for cluster in clusters:
+            if text.lower() == cluster["text"].lower() or _similar(words, cluster["words"]):
+                break
+        else:
+            cluster = {"text": text, "words": words, "count": 0, "right": 0, "left": 0}
+            clusters.append(cluster)
+        cluster["count"] += 1
+        if swipe:
+            cluster[swipe] += 1
+    rng.shuffle(clusters)
+    clusters.sort(key=lambda c: -c["count"])
+    return clusters
+
+
+class FeedbackSummary:
+    """
+    Panel feedback reduced to swipe consensus, average scores and deduplicated
+    statements. `key` is a hash of the canonical (order-independent) input, the
+    goal and the model, used to memoize the combine call.
+    """
+
+    def __init__(self, feedbacks, goal, model):
+        canonical = sorted(
+            (_normalize(f) for f in feedbacks if isinstance(f, dict)),
+            key=lambda f: json.dumps(f, sort_keys=True, ensure_ascii=False),
+        )
+        material = json.dumps([COMBINE_PROMPT_VERSION, model, goal, canonical], sort_keys=True, ensure_ascii=False)
+        self.key = hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+        self.total = len(canonical)
+        self.right = sum(1 for f in canonical if f["swipe"] == "right")
+        self.left = sum(1 for f in canonical if f["swipe"] == "left")
+
+        totals = {}
+        for f in canonical:
+            for name, value in f["scores"].items():
+                totals.setdefault(name, []).append(value)
+        self.scores = {name: round(sum(v) / len(v), 1) for name, v in sorted(totals.items())}
+
+        # Seeded by the input itself: the same panel always gets the same order
+        rng = random.Random(int(self.key[:16], 16))
+        self.statements = {
+            field: _cluster([(f[field], f["swipe"]) for f in canonical if f[field]], rng)
+            for field in STATEMENT_FIELDS
+        }
+
+    def render(self):
+        """
+        Compact text for the combine prompt.
+        """
+        lines = [f"Swipes: {self.right} right, {self.left} left, out of {self.total} judges"]
+        if self.scores:
+            lines.append("Average scores (1-10): " + ", ".join(f"{k} {v}" for k, v in self.scores.items()))
+        for field in STATEMENT_FIELDS:
+            clusters = self.statements[field]
+            if not clusters:
+                continue
+            lines.append("")
+            lines.append(f"{field.upper()}:")
+            for cluster in clusters[:COMBINE_MAX_STATEMENTS]:
+                lines.append(
+                    f"- [{cluster['count']} judge(s): {cluster['right']} right, {cluster['left']} left] {cluster['text']}"
+                )
+            omitted = len(clusters) - COMBINE_MAX_STATEMENTS
+            if omitted > 0:
+                lines.append(f"- (+{omitted} less common points omitted)")
+        return "\n".join(lines)
@@ -0,0 +1,142 @@
+"""
+Local stand-in for OpenRouter's /api/v1/chat/completions, used by run_bench.py.
+
+Requests are classified as evaluate, panel, combine or generate from the model
+and system prompt, and answered with well-formed responses after a lognormal
+delay. Configured through MOCK_* environment variables (see run_bench.py).
+"""
+import asyncio
+import base64
+import json
+import math
+import os
+import random
+import re
+from collections import Counter
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+# Per-kind latency as "median:sigma" seconds of a lognormal distribution
+MOCK_LATENCY = {
+    "evaluate": os.environ.get("MOCK_LATENCY_EVALUATE", "2.0:0.4"),
+    "panel": os.environ.get("MOCK_LATENCY_PANEL", "5.0:0.4"),
+    "combine": os.environ.get("MOCK_LATENCY_COMBINE", "4.0:0.3"),
+    "generate": os.environ.get("MOCK_LATENCY_GENERATE", "12.0:0.3"),
+}
+# Multiplies every delay, so a run can keep the shape of real latencies but finish quickly
+MOCK_TIME_SCALE = float(os.environ.get("MOCK_TIME_SCALE", "0.1"))
+# Fraction of calls answered with a 500, and with a 429 + Retry-After
+MOCK_ERROR_RATE = float(os.environ.get("MOCK_ERROR_RATE", "0.0"))
+MOCK_RATE_LIMIT_RATE = float(os.environ.get("MOCK_RATE_LIMIT_RATE", "0.0"))
+# Size of each generated image returned as a data URI
+MOCK_IMAGE_KB = int(os.environ.get("MOCK_IMAGE_KB", "1024"))
+MOCK_SEED = int(os.environ.get("MOCK_SEED", "0"))
+
+_PANEL_KEY = re.compile(r"key `(\d+)`")
+
+app = FastAPI()
+rng = random.Random(MOCK_SEED)
+calls = Counter()
+request_bytes = Counter()
+_image_uri = None
+
+
+def _parse_latency(spec):
+    median, sigma = (float(x) for x in spec.split(":"))
+    return median, sigma
+
+
+LATENCY = {kind: _parse_latency(spec) for kind, spec in MOCK_LATENCY.items()}
+
+
+def _classify(body):
+    if str(body.get("model", "")).startswith("google/"):
+        return "generate"
+    system = ""
+    for message in body.get("messages", []):
+        if message.get("role") == "system" and isinstance(message.get("content"), str):
+            system = message["content"]
+    if "panel of different people" in system:
+        return "panel"
+    if "image generation specialist" in system:
+        return "combine"
+    return "evaluate"
+
+
+def _verdict():
+    return {
+        "swipe": rng.choice(("left", "right")),
+        "first_impression": "Friendly, well lit photo.",
+        "reason": "Looks approachable and natural.",
+        "likes": "Genuine smile, clean background.",
+        "dislikes": "Slightly soft focus.",
+        "keep": "The smile and the framing.",
+        "change": "Use warmer light and a sharper lens.",
+        "scores": {
+            "attractiveness": rng.randint(3, 9),
+            "authenticity": rng.randint(3, 9),
+            "photo_quality": rng.randint(3, 9),
+            "overall_swipeability": rng.randint(3, 9),
+        },
+    }
+
+
+def _generated_image():
+    global _image_uri
+    if _image_uri is None:
+        payload = random.Random(MOCK_SEED).randbytes(MOCK_IMAGE_KB * 1024)
+        _image_uri = "data:image/png;base64," + base64.b64encode(payload).decode("ascii")
+    return _image_uri
+
+
+def _completion(kind, body):
+    if kind == "generate":
+        message = {"role": "assistant", "content": "", "images": [{"type": "image_url", "image_url": {"url": _generated_image()}}]}
+    elif kind == "panel":
+        system = next(m["content"] for m in body["messages"] if m.get("role") == "system")
+        keys = _PANEL_KEY.findall(system)
+        content = json.dumps({"verdicts": [{"key": key, **_verdict()} for key in keys]})
+        message = {"role": "assistant", "content": content}
+    elif kind == "combine":
+        content = json.dumps({
+            "thinking": "Most panelists liked the smile; lighting is the main complaint.",
+            "prompt": "Lifestyle portrait, genuine smile, golden hour light from the left, outdoor cafe, eye level, medium-close framing",
+            "priority_changes": ["Warmer light"],
+            "consensus_keeps": ["Smile"],
+        })
+        message = {"role": "assistant", "content": content}
+    else:
+        message = {"role": "assistant", "content": json.dumps(_verdict())}
+    return {"id": "mock", "model": body.get("model"), "choices": [{"index": 0, "message": message}]}
+
+
+@app.post("/api/v1/chat/completions")
+async def chat_completions(request: Request):
+    raw = await request.body()
+    body = json.loads(raw)
+    kind = _classify(body)
+    request_bytes[kind] += len(raw)
+
+    median, sigma = LATENCY[kind]
+    await asyncio.sleep(median * math.exp(rng.gauss(0, sigma)) * MOCK_TIME_SCALE)
+
+    roll = rng.random()
+    if roll < MOCK_ERROR_RATE:
+        calls[f"{kind}:500"] += 1
+        return JSONResponse(status_code=500, content={"error": {"message": "mock upstream error"}})
+    if roll < MOCK_ERROR_RATE + MOCK_RATE_LIMIT_RATE:
+        calls[f"{kind}:429"] += 1
+        retry_after = max(1, round(1.0 * MOCK_TIME_SCALE))
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": "mock rate limit"}},
+            headers={"Retry-After": str(retry_after)},
+        )
+    calls[f"{kind}:200"] += 1
+    return _completion(kind, body)
+
+
+@app.get("/stats")
+def stats():
+    return {"calls": dict(calls), "requestBytes": dict(request_bytes)}
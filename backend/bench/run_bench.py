@@ -0,0 +1,382 @@
+"""
+Offline load test: runs the API against a local OpenRouter stand-in and reports
+throughput, latency percentiles, memory and upstream calls per scenario.
+
+    cd backend
+    python bench/run_bench.py --requests 50 --concurrency 8 --panel-size 5
+    python bench/run_bench.py --output before.json
+    python bench/run_bench.py --compare before.json
+
+The app and the mock each run in their own uvicorn process. Use --seed,
+--requests and the mock settings unchanged between runs to compare commits.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+from PIL import Image
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+PERSONAS_PATH = os.path.join(BACKEND_DIR, "..", "frontend", "src", "data", "personas.json")
+
+SCENARIOS = ("evaluate", "batch", "stream", "combine", "generate")
+
+# The limiter defaults are sized for real OpenRouter quotas; lift them so the
+# benchmark measures the app rather than the token bucket. Override with --app-env.
+DEFAULT_APP_ENV = {
+    "OPENROUTER_API_KEY": "bench-key",
+    "EVAL_CACHE_ENABLED": "0",
+    "COMBINE_CACHE_ENABLED": "0",
+    "LOG_LEVEL": "WARNING",
+    "RATE_LIMIT_DEFAULT_RPS": "10000",
+    "RATE_LIMIT_DEFAULT_BURST": "10000",
+    "RATE_LIMIT_DEFAULT_MAX_IN_FLIGHT": "1024",
+    "RATE_LIMIT_MAX_QUEUE": "100000",
+}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _git_revision():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=BACKEND_DIR, capture_output=True, text=True
+        ).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def _rss_kb(pid, field="VmRSS"):
+    """
+    Resident memory of `pid` and its worker processes in KiB from /proc
+    (Linux only; None elsewhere).
+    """
+    total = None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    total = int(line.split()[1])
+    except OSError:
+        return None
+    for child in _children(pid):
+        total = (total or 0) + (_rss_kb(child, field) or 0)
+    return total
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def _make_image(size, seed):
+    """
+    A noisy JPEG of roughly phone-photo size and entropy, so encode costs are realistic.
+    """
+    width, height = size
+    noise = random.Random(seed).randbytes(width * height * 3 // 64)
+    small = Image.frombytes("RGB", (width // 8, height // 8), noise[: (width // 8) * (height // 8) * 3])
+    buffer = io.BytesIO()
+    small.resize((width, height), Image.BILINEAR).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def _start_server(app_path, app_dir, port, env):
+    return subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", app_path,
+            "--app-dir", app_dir, "--host", "127.0.0.1", "--port", str(port),
+            "--log-level", "warning", "--no-access-log",
+        ],
+        env={**os.environ, **env},
+    )
+
+
+async def _wait_ready(url, process, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Server for {url} exited with code {process.returncode}")
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"Server at {url} did not start within {timeout}s")
+
+
+class Bench:
+    def __init__(self, args, app_url, mock_url, app_pid):
+        self.args = args
+        self.app_url = app_url
+        self.mock_url = mock_url
+        self.app_pid = app_pid
+        self.image = _make_image(args.image_size, args.seed)
+        with open(PERSONAS_PATH, encoding="utf-8") as f:
+            personas = json.load(f)
+        # Cycle through the built-in personas to reach the requested panel size
+        self.panel = [personas[i % len(personas)] for i in range(args.panel_size)]
+
+    def _request(self, scenario):
+        args = self.args
+        image = ("photo.jpg", self.image, "image/jpeg")
+        panel_ids = json.dumps([p["id"] for p in self.panel])
+        if scenario == "evaluate":
+            return "POST", "/api/evaluate", {"data": {"personaId": str(self.panel[0]["id"])}, "files": {"image": image}}
+        if scenario == "batch":
+            data = {"personas": panel_ids, "mode": args.mode}
+            return "POST", "/api/evaluate/batch", {"data": data, "files": {"image": image}}
+        if scenario == "stream":
+            data = {"personas": panel_ids, "mode": args.mode}
+            return "POST", "/api/evaluate/stream", {"data": data, "files": {"image": image}}
+        if scenario == "combine":
+            feedbacks = [
+                {"name": p["name"], "swipe": "right" if i % 2 else "left", "content": "Reason: bench",
+                 "likes": "smile", "dislikes": "lighting", "keep": "pose", "change": "background"}
+                for i, p in enumerate(self.panel)
+            ]
+            return "POST", "/api/combine", {"json": {"feedbacks": feedbacks, "goal": "right"}}
+        if scenario == "generate":
+            data = {"suggestions": "Lifestyle portrait, golden hour", "count": str(args.generate_count)}
+            return "POST", "/api/generate", {"data": data, "files": {"originalImage": image}}
+        raise ValueError(scenario)
+
+    async def _one(self, client, scenario, worker):
+        method, path, kwargs = self._request(scenario)
+        headers = {"X-Client-Id": f"bench-{worker}"}
+        start = time.perf_counter()
+        first_event = None
+        async with client.stream(method, path, headers=headers, **kwargs) as response:
+            async for _ in response.aiter_bytes():
+                if first_event is None:
+                    first_event = time.perf_counter() - start
+        return response.status_code, time.perf_counter() - start, first_event
+
+    async def _sample_memory(self, peak, stop):
+        while not stop.is_set():
+            rss = _rss_kb(self.app_pid)
+            if rss is not None:
+                peak["rss"] = max(peak["rss"], rss)
+            await asyncio.sleep(0.05)
+
+    async def _mock_calls(self, client):
+        return (await client.get(f"{self.mock_url}/stats")).json()["calls"]
+
+    async def run_scenario(self, client, mock_client, scenario):
+        args = self.args
+        latencies = []
+        first_events = []
+        statuses = {}
+        remaining = iter(range(args.requests))
+
+        async def worker(index):
+            for _ in remaining:
+                status, elapsed, first_event = await self._one(client, scenario, index)
+                statuses[status] = statuses.get(status, 0) + 1
+                latencies.append(elapsed)
+                if first_event is not None:
+                    first_events.append(first_event)
+
+        # Warm up connections and lazy imports outside the measured window
+        for _ in range(args.warmup):
+            await self._one(client, scenario, 0)
+
+        calls_before = await self._mock_calls(mock_client)
+        peak = {"rss": _rss_kb(self.app_pid) or 0}
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(self._sample_memory(peak, stop))
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+        wall = time.perf_counter() - start
+        stop.set()
+        await sampler
+        calls_after = await self._mock_calls(mock_client)
+
+        upstream = {k: calls_after.get(k, 0) - calls_before.get(k, 0) for k in calls_after}
+        upstream = {k: v for k, v in sorted(upstream.items()) if v}
+        ms = lambda v: round(v * 1000, 1) if v is not None else None
+        return {
+            "requests": len(latencies),
+            "wallSeconds": round(wall, 3),
+            "rps": round(len(latencies) / wall, 2) if wall else None,
+            "p50Ms": ms(_percentile(latencies, 50)),
+            "p95Ms": ms(_percentile(latencies, 95)),
+            "p99Ms": ms(_percentile(latencies, 99)),
+            "firstByteP50Ms": ms(_percentile(first_events, 50)),
+            "statuses": {str(k): v for k, v in sorted(statuses.items())},
+            "upstreamCalls": upstream,
+            "upstreamCallsPerRequest": round(sum(upstream.values()) / len(latencies), 2) if latencies else None,
+            "peakRssMb": round(peak["rss"] / 1024, 1) if peak["rss"] else None,
+        }
+
+    async def run(self):
+        limits = httpx.Limits(max_connections=self.args.concurrency * 2)
+        timeout = httpx.Timeout(self.args.timeout)
+        results = {}
+        async with httpx.AsyncClient(base_url=self.app_url, limits=limits, timeout=timeout) as client, \
+                httpx.AsyncClient() as mock_client:
+            for scenario in self.args.scenarios:
+                results[scenario] = await self.run_scenario(client, mock_client, scenario)
+                _print_row(scenario, results[scenario])
+        return results
+
+
+def _print_header():
+    print(f"{'scenario':<10} {'req':>5} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rss MB':>8} {'up/req':>7}  statuses")
+
+
+def _print_row(scenario, r):
+    print(
+        f"{scenario:<10} {r['requests']:>5} {r['rps'] or 0:>8.2f} {r['p50Ms'] or 0:>9.1f} {r['p95Ms'] or 0:>9.1f} "
+        f"{r['p99Ms'] or 0:>9.1f} {r['peakRssMb'] or 0:>8.1f} {r['upstreamCallsPerRequest'] or 0:>7.2f}  {r['statuses']}"
+    )
+
+
+def _print_comparison(baseline, results):
+    print(f"\nChange vs {baseline['meta'].get('revision', '?')}:")
+    for scenario, r in results.items():
+        before = baseline["results"].get(scenario)
+        if not before:
+            continue
+        parts = []
+        for key in ("rps", "p50Ms", "p95Ms", "p99Ms", "peakRssMb"):
+            if before.get(key) and r.get(key) is not None:
+                parts.append(f"{key} {100 * (r[key] - before[key]) / before[key]:+.1f}%")
+        print(f"{scenario:<10} " + ", ".join(parts))
+
+
+def _parse_size(text):
+    width, height = (int(x) for x in text.lower().split("x"))
+    return width, height
+
+
+def _parse_env(items):
+    env = {}
+    for item in items:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return env
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of " + ", ".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=40, help="measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent virtual clients")
+    parser.add_argument("--warmup", type=int, default=2, help="unmeasured requests before each scenario")
+    parser.add_argument("--panel-size", type=int, default=5, help="personas per batch/stream/combine request")
+    parser.add_argument("--mode", default="per_persona", choices=("per_persona", "single_call"))
+    parser.add_argument("--image-size", type=_parse_size, default=(3024, 4032), help="upload size, WxH")
+    parser.add_argument("--generate-count", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-request client timeout")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--time-scale", type=float, default=0.1, help="multiplier on mock latencies")
+    parser.add_argument("--latency", action="append", default=[], metavar="KIND=MEDIAN:SIGMA",
+                        help="mock latency for evaluate/panel/combine/generate, in seconds before scaling")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of mock calls returning 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of mock calls returning 429")
+    parser.add_argument("--image-kb", type=int, default=1024, help="size of each generated image from the mock")
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE", help="extra env for the app")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", help="earlier --output file to diff against")
+    args = parser.parse_args(argv)
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+async def main(argv=None):
+    args = parse_args(argv)
+    mock_port, app_port = _free_port(), _free_port()
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    app_url = f"http://127.0.0.1:{app_port}"
+
+    mock_env = {
+        "MOCK_TIME_SCALE": str(args.time_scale),
+        "MOCK_ERROR_RATE": str(args.error_rate),
+        "MOCK_RATE_LIMIT_RATE": str(args.rate_limit_rate),
+        "MOCK_IMAGE_KB": str(args.image_kb),
+        "MOCK_SEED": str(args.seed),
+    }
+    for item in args.latency:
+        kind, _, spec = item.partition("=")
+        mock_env[f"MOCK_LATENCY_{kind.upper()}"] = spec
+    app_env = {
+        **DEFAULT_APP_ENV,
+        "OPENROUTER_URL": f"{mock_url}/api/v1/chat/completions",
+        "BLOB_DIR": os.path.join(BENCH_DIR, ".blobs"),
+        **_parse_env(args.app_env),
+    }
+
+    mock = _start_server("mock_openrouter:app", BENCH_DIR, mock_port, mock_env)
+    app = _start_server("main:app", BACKEND_DIR, app_port, app_env)
+    try:
+        await _wait_ready(f"{mock_url}/stats", mock)
+        await _wait_ready(f"{app_url}/", app)
+        _print_header()
+        results = await Bench(args, app_url, mock_url, app.pid).run()
+    finally:
+        for process in (app, mock):
+            process.terminate()
+        for process in (app, mock):
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    report = {
+        "meta": {
+            "revision": _git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+            "mockEnv": mock_env,
+            "appEnv": {k: v for k, v in app_env.items() if k != "OPENROUTER_API_KEY"},
+        },
+        "results": results,
+    }
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            _print_comparison(json.load(f), results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
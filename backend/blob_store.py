@@ -0,0 +1,127 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+# Content-addressed storage for generated images
+BLOB_DIR = os.environ.get(
+    "BLOB_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "blobs")
+)
+BLOB_TTL = float(os.environ.get("BLOB_TTL", str(7 * 24 * 3600)))
+BLOB_CLEANUP_INTERVAL = float(os.environ.get("BLOB_CLEANUP_INTERVAL", "3600"))
+
+_EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/webp": "webp", "image/gif": "gif"}
+_MIME_TYPES = {ext: mime for mime, ext in _EXTENSIONS.items()}
+_BLOB_ID = re.compile(r"^[0-9a-f]{64}\.(jpg|png|webp|gif)$")
+_DATA_URI = re.compile(r"^data:(?P<mime>[\w/+.-]+);base64,", re.IGNORECASE)
+
+
+class BlobNotFound(Exception):
+    pass
+
+
+def is_blob_id(blob_id):
+    return isinstance(blob_id, str) and bool(_BLOB_ID.match(blob_id))
+
+
+def mime_type_for(blob_id):
+    return _MIME_TYPES[blob_id.rsplit(".", 1)[1]]
+
+
+class BlobStore:
+    """
+    Files named `<sha256>.<ext>` under `root`; writing the same content twice is a no-op.
+    """
+
+    def __init__(self, root=BLOB_DIR, ttl=BLOB_TTL):
+        self.root = root
+        self.ttl = ttl
+
+    def path(self, blob_id):
+        if not is_blob_id(blob_id):
+            raise BlobNotFound(f"Invalid image id: {blob_id}")
+        return os.path.join(self.root, blob_id)
+
+    def _write(self, blob_id, data):
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, blob_id)
+        if os.path.exists(path):
+            # Refresh the TTL for content we've seen again
+            os.utime(path)
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    async def put(self, data, mime_type):
+        blob_id = f"{hashlib.sha256(data).hexdigest()}.{_EXTENSIONS.get(mime_type, 'jpg')}"
+        await asyncio.to_thread(self._write, blob_id, data)
+        return blob_id
+
+    async def put_data_uri(self, uri):
+        """
+        Decode a base64 data URI and store it. Returns None for anything else
+        (e.g. a plain https URL), which callers should pass through unchanged.
+        """
+        match = _DATA_URI.match(uri or "")
+        if not match:
+            return None
+        try:
+            data = base64.b64decode(uri[match.end():], validate=False)
+        except (binascii.Error, ValueError) as e:
+            logger.error(f"[BLOBS] Could not decode data URI: {e}")
+            return None
+        return await self.put(data, match.group("mime").lower())
+
+    async def read(self, blob_id):
+        path = self.path(blob_id)
+        try:
+            return await asyncio.to_thread(_read_file, path)
+        except FileNotFoundError:
+            raise BlobNotFound(f"Image not found: {blob_id}")
+
+    def exists(self, blob_id):
+        return is_blob_id(blob_id) and os.path.exists(os.path.join(self.root, blob_id))
+
+    def cleanup(self):
+        if not os.path.isdir(self.root):
+            return 0
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        if removed:
+            logger.info(f"[BLOBS] Removed {removed} expired blob(s)")
+        return removed
+
+    async def cleanup_loop(self):
+        while True:
+            await asyncio.to_thread(self.cleanup)
+            await asyncio.sleep(BLOB_CLEANUP_INTERVAL)
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+blob_store = BlobStore()
@@ -0,0 +1,241 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import CACHE_LOOKUPS, endpoint_label, persona_label
+from state import shared_state
+
+logger = logging.getLogger(__name__)
+
+# Persona evaluation cache: in-memory LRU tier plus an optional SQLite tier
+# (or, with a shared STATE_BACKEND, the shared store so all workers reuse verdicts)
+EVAL_CACHE_ENABLED = os.environ.get("EVAL_CACHE_ENABLED", "1") not in ("0", "false", "False")
+EVAL_CACHE_MAX_ENTRIES = int(os.environ.get("EVAL_CACHE_MAX_ENTRIES", "1024"))
+EVAL_CACHE_TTL = float(os.environ.get("EVAL_CACHE_TTL", "86400"))
+EVAL_CACHE_DB_PATH = os.environ.get("EVAL_CACHE_DB_PATH", "")
+# Bound of the second tier, SQLite file or shared store alike
+EVAL_CACHE_DB_MAX_ENTRIES = int(os.environ.get("EVAL_CACHE_DB_MAX_ENTRIES", "10000"))
+
+# Combine results memoized on the canonical hash of the aggregated feedback
+COMBINE_CACHE_ENABLED = os.environ.get("COMBINE_CACHE_ENABLED", "1") not in ("0", "false", "False")
+COMBINE_CACHE_MAX_ENTRIES = int(os.environ.get("COMBINE_CACHE_MAX_ENTRIES", "256"))
+COMBINE_CACHE_TTL = float(os.environ.get("COMBINE_CACHE_TTL", str(EVAL_CACHE_TTL)))
+# Bound of the shared-store tier used with a shared STATE_BACKEND
+COMBINE_CACHE_DB_MAX_ENTRIES = int(os.environ.get("COMBINE_CACHE_DB_MAX_ENTRIES", "2500"))
+
+# Shared tiers are trimmed back to their bound once per this share of it in writes
+# (per worker), instead of counting the namespace on every write
+_STATE_TRIM_FRACTION = 0.05
+
+
+def evaluation_cache_key(image_hash, prompt_hash, model, mode="per_persona"):
+    """
+    Key a persona verdict on the image content, the persona's prompt hash, the model id
+    and the evaluation mode, so single-call panel verdicts never answer per-persona requests.
+    """
+    material = json.dumps([image_hash, prompt_hash, model, mode])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class MemoryCache:
+    """
+    LRU cache with per-entry TTL. Not thread-safe; used from the event loop only.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._entries[key] = (time.time() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """
+    On-disk tier storing JSON values with an expiry and last-access time.
+    Evicts expired rows, then least recently used ones above `max_entries`.
+    """
+
+    def __init__(self, path, max_entries, ttl):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+
+    def _get(self, key):
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def _set(self, key, value):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + self.ttl, now),
+            )
+            self._conn.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+            self._conn.execute(
+                "DELETE FROM cache WHERE key NOT IN"
+                " (SELECT key FROM cache ORDER BY accessed_at DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+    def _count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    async def get(self, key):
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key, value):
+        await asyncio.to_thread(self._set, key, value)
+
+    async def count(self):
+        return await asyncio.to_thread(self._count)
+
+
+class StateCache:
+    """
+    Second tier kept in the shared state backend. Entries expire by TTL; every
+    few writes the namespace is trimmed back to `max_entries`, dropping the
+    entries written longest ago, so it can briefly overshoot the bound.
+    """
+
+    def __init__(self, state, namespace, max_entries, ttl):
+        self.state = state
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._trim_every = max(1, int(max_entries * _STATE_TRIM_FRACTION))
+        self._writes = 0
+
+    async def get(self, key):
+        return await self.state.get(self.namespace, key)
+
+    async def set(self, key, value):
+        await self.state.set(self.namespace, key, value, self.ttl)
+        self._writes += 1
+        if self._writes >= self._trim_every:
+            self._writes = 0
+            removed = await self.state.trim(self.namespace, self.max_entries)
+            if removed:
+                logger.debug(f"[CACHE] Trimmed {removed} entries from the shared {self.namespace} tier")
+
+    async def count(self):
+        return await self.state.count(self.namespace)
+
+
+class EvaluationCache:
+    """
+    Two-tier cache for model results (persona verdicts, combined feedback) with
+    hit/miss counters.
+    Disk hits are promoted into the memory tier. Counters are per process.
+    """
+
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    async def get(self, key, persona=None):
+        result = "hit"
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = await self.disk.get(key)
+            if value is not None:
+                result = "disk_hit"
+                self.disk_hits += 1
+                self.memory.set(key, value)
+        if value is None:
+            result = "miss"
+            self.misses += 1
+        else:
+            self.hits += 1
+        CACHE_LOOKUPS.labels(result, persona_label(persona), endpoint_label()).inc()
+        return value
+
+    async def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            await self.disk.set(key, value)
+
+    async def stats(self):
+        return {
+            "hits": self.hits,
+            "diskHits": self.disk_hits,
+            "misses": self.misses,
+            "memoryEntries": len(self.memory),
+            "diskEntries": await self.disk.count() if self.disk is not None else 0,
+        }
+
+
+def _build_evaluation_cache():
+    if not EVAL_CACHE_ENABLED:
+        return None
+    disk = None
+    if EVAL_CACHE_DB_PATH:
+        disk = SQLiteCache(EVAL_CACHE_DB_PATH, EVAL_CACHE_DB_MAX_ENTRIES, EVAL_CACHE_TTL)
+        logger.info(f"[CACHE] Persistent evaluation cache at {EVAL_CACHE_DB_PATH}")
+    elif shared_state.shared:
+        disk = StateCache(shared_state, "eval", EVAL_CACHE_DB_MAX_ENTRIES, EVAL_CACHE_TTL)
+    return EvaluationCache(MemoryCache(EVAL_CACHE_MAX_ENTRIES, EVAL_CACHE_TTL), disk)
+
+
+def _build_combine_cache():
+    if not COMBINE_CACHE_ENABLED:
+        return None
+    disk = None
+    if shared_state.shared:
+        disk = StateCache(shared_state, "combine", COMBINE_CACHE_DB_MAX_ENTRIES, COMBINE_CACHE_TTL)
+    return EvaluationCache(MemoryCache(COMBINE_CACHE_MAX_ENTRIES, COMBINE_CACHE_TTL), disk)
+
+
+# Process-wide instances; None when caching is disabled
+evaluation_cache = _build_evaluation_cache()
+combine_cache = _build_combine_cache()
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Hedged requests: fire a duplicate call when the first one is slower than the
+# HEDGE_PERCENTILE of recent latencies, bounded by a global budget
+HEDGE_ENABLED = os.environ.get("HEDGE_ENABLED", "1") not in ("0", "false", "False")
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", "1.0"))
+HEDGE_DEFAULT_DELAY = float(os.environ.get("HEDGE_DEFAULT_DELAY", "8.0"))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WINDOW = int(os.environ.get("HEDGE_WINDOW", "200"))
+# Extra calls allowed per primary call, and how many may be saved up
+HEDGE_BUDGET_RATIO = float(os.environ.get("HEDGE_BUDGET_RATIO", "0.1"))
+HEDGE_BUDGET_BURST = float(os.environ.get("HEDGE_BUDGET_BURST", "5"))
+
+
+class HedgePolicy:
+    """
+    Tracks recent call latencies to pick the hedge delay and meters how many
+    duplicate calls may be sent: every primary call earns HEDGE_BUDGET_RATIO
+    of a token, every hedge spends one.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = deque(maxlen=HEDGE_WINDOW)
+        self.tokens = HEDGE_BUDGET_BURST
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+
+    def record(self, latency):
+        self.latencies.append(latency)
+
+    def delay(self):
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * HEDGE_PERCENTILE / 100))
+        return max(HEDGE_MIN_DELAY, ordered[index])
+
+    def on_primary(self):
+        self.calls += 1
+        self.tokens = min(HEDGE_BUDGET_BURST, self.tokens + HEDGE_BUDGET_RATIO)
+
+    def try_spend(self):
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.hedges += 1
+            return True
+        self.budget_denied += 1
+        return False
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "hedges": self.hedges,
+            "hedgeWins": self.hedge_wins,
+            "budgetDenied": self.budget_denied,
+            "delay": self.delay(),
+        }
+
+
+async def hedged_call(make_call, policy, hedge=True):
+    """
+    Await `make_call(on_admitted)`, where the call invokes `on_admitted()` once
+    local admission control lets it go upstream. With `hedge`, if it has not
+    finished the policy's delay after that and budget allows, start a second
+    identical call and return whichever succeeds first, cancelling the other.
+    Latency is recorded either way, from the primary's admission, so time spent
+    queueing locally neither triggers hedges nor inflates the delay.
+    """
+    policy.on_primary()
+    admitted = asyncio.Event()
+    sent = {}
+
+    def on_admitted():
+        if not admitted.is_set():
+            sent["at"] = time.monotonic()
+            admitted.set()
+
+    primary = asyncio.create_task(make_call(on_admitted))
+    tasks = {primary}
+    try:
+        if hedge:
+            admission = asyncio.create_task(admitted.wait())
+            try:
+                await asyncio.wait({primary, admission}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                admission.cancel()
+            delay = policy.delay()
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and policy.try_spend():
+                logger.info(f"[HEDGE] {policy.name}: no response after {delay:.2f}s, sending hedge request")
+                tasks.add(asyncio.create_task(make_call(lambda: None)))
+
+        first_error = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not primary:
+                        policy.hedge_wins += 1
+                    if "at" in sent:
+                        policy.record(time.monotonic() - sent["at"])
+                    return task.result()
+                # Prefer reporting the primary's error if both fail
+                if first_error is None or task is primary:
+                    first_error = task.exception()
+        raise first_error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
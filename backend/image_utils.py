@@ -0,0 +1,183 @@
+import asyncio
+import base64
+import hashlib
+import io
+import logging
+import os
+from dataclasses import dataclass, field
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from metrics import IMAGE_DECODE_BYTES, endpoint_label
+
+logger = logging.getLogger(__name__)
+
+# Uploads are normalized to this size/format before being sent to the models
+IMAGE_MAX_EDGE = int(os.environ.get("IMAGE_MAX_EDGE", "1024"))
+IMAGE_FORMAT = os.environ.get("IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", "85"))
+# Images with more pixels than this are rejected instead of decoded
+IMAGE_MAX_PIXELS = int(os.environ.get("IMAGE_MAX_PIXELS", str(50_000_000)))
+# Decodes allowed at once; with the size caps above this bounds image memory per worker
+IMAGE_DECODE_CONCURRENCY = int(os.environ.get("IMAGE_DECODE_CONCURRENCY", str(os.cpu_count() or 4)))
+
+# We check the limit ourselves so oversized images fail cleanly rather than with a DecompressionBombError
+Image.MAX_IMAGE_PIXELS = None
+
+_decode_slots = asyncio.Semaphore(IMAGE_DECODE_CONCURRENCY)
+
+_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png", "GIF": "image/gif"}
+
+# Magic-byte prefixes used to label images we could not decode
+_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF8", "image/gif"),
+    (b"RIFF", "image/webp"),
+]
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class PreparedImage:
+    """
+    An image encoded once and shared by every model call that needs it.
+    `base64` is kept as ASCII bytes so request bodies can splice it in without
+    re-encoding (see upstream.encode_payload).
+    """
+    data: bytes
+    mime_type: str
+    base64: bytes = field(init=False, repr=False)
+    sha256: str = field(init=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "base64", base64.b64encode(self.data))
+        object.__setattr__(self, "sha256", hashlib.sha256(self.data).hexdigest())
+
+    @property
+    def data_uri_prefix(self):
+        return f"data:{self.mime_type};base64,".encode("ascii")
+
+
+def sniff_mime_type(image_bytes):
+    for signature, mime_type in _SIGNATURES:
+        if image_bytes.startswith(signature):
+            return mime_type
+    return "image/jpeg"
+
+
+def _read_all(source):
+    if hasattr(source, "read"):
+        source.seek(0)
+        return source.read()
+    return bytes(source)
+
+
+def _is_normalized(img):
+    """
+    Whether a decoded image already looks like prepare_image output: the target
+    format, within IMAGE_MAX_EDGE and without EXIF.
+    """
+    return (
+        img.format == IMAGE_FORMAT
+        and max(img.size) <= IMAGE_MAX_EDGE
+        and "exif" not in img.info
+        and (IMAGE_FORMAT != "JPEG" or img.mode == "RGB")
+    )
+
+
+def prepare_image(source, keep_normalized=False):
+    """
+    Decode an upload, apply its EXIF orientation, drop metadata, downscale so the
+    longest edge is at most IMAGE_MAX_EDGE and re-encode as IMAGE_FORMAT.
+    With `keep_normalized` (images from our own blob store), input that is
+    already normalized is returned byte for byte: re-encoding it would lose
+    quality and change its hash, and with it the evaluation cache key.
+    `source` is bytes or a binary file object (e.g. a spooled upload), read in place.
+    Undecodable input is passed through unchanged with a sniffed MIME type.
+    CPU-bound: call via asyncio.to_thread from request handlers.
+    """
+    stream = source if hasattr(source, "read") else io.BytesIO(source)
+    try:
+        with Image.open(stream) as img:
+            width, height = img.size
+            if width * height > IMAGE_MAX_PIXELS:
+                raise ImageTooLarge(f"Image is {width}x{height}; the limit is {IMAGE_MAX_PIXELS} pixels")
+            if keep_normalized and _is_normalized(img):
+                raw = _read_all(source)
+                return PreparedImage(raw, _MIME_TYPES.get(IMAGE_FORMAT, "image/jpeg"))
+            # Let the JPEG decoder downscale by 1/2..1/8 while decoding instead of
+            # materializing the full-resolution bitmap first
+            img.draft("RGB", (IMAGE_MAX_EDGE, IMAGE_MAX_EDGE))
+            IMAGE_DECODE_BYTES.labels(endpoint_label()).observe(
+                img.size[0] * img.size[1] * len(img.getbands())
+            )
+            img = ImageOps.exif_transpose(img)
+            if max(img.size) > IMAGE_MAX_EDGE:
+                img.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE), Image.LANCZOS)
+            if IMAGE_FORMAT == "JPEG" and img.mode != "RGB":
+                img = img.convert("RGB")
+            out = io.BytesIO()
+            # Saving without exif= drops the metadata block
+            img.save(out, format=IMAGE_FORMAT, quality=IMAGE_QUALITY, optimize=True)
+    except (UnidentifiedImageError, OSError) as e:
+        logger.warning(f"[IMAGE] Could not decode image, sending as-is: {e}")
+        raw = _read_all(source)
+        return PreparedImage(raw, sniff_mime_type(raw))
+
+    prepared = PreparedImage(out.getvalue(), _MIME_TYPES.get(IMAGE_FORMAT, "image/jpeg"))
+    logger.info(f"[IMAGE] Normalized {width}x{height} -> {len(prepared.data)} bytes ({prepared.mime_type})")
+    return prepared
+
+
+async def prepare_image_async(source, keep_normalized=False):
+    """
+    prepare_image off the event loop, with at most IMAGE_DECODE_CONCURRENCY
+    decodes in flight.
+    """
+    async with _decode_slots:
+        return await asyncio.to_thread(prepare_image, source, keep_normalized)
+
+
+def perceptual_hash(image):
+    """
+    64-bit difference hash (dHash) of a prepared image as 16 hex digits: near-
+    identical pictures get hashes a few bits apart, re-encodes and small edits
+    barely move it. None if the image could not be decoded.
+    """
+    try:
+        with Image.open(io.BytesIO(image.data)) as img:
+            img.draft("L", (64, 64))
+            pixels = img.convert("L").resize((9, 8), Image.LANCZOS).tobytes()
+    except (UnidentifiedImageError, OSError):
+        return None
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            offset = row * 9 + col
+            bits = (bits << 1) | (pixels[offset] < pixels[offset + 1])
+    return f"{bits:016x}"
+
+
+def hash_distance(a, b):
+    """
+    Number of differing bits between two perceptual hashes (0-64).
+    """
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+async def perceptual_hash_async(image):
+    async with _decode_slots:
+        return await asyncio.to_thread(perceptual_hash, image)
+
+
+def as_prepared(image):
+    """
+    Accept either raw bytes or an already prepared image.
+    """
+    if image is None or isinstance(image, PreparedImage):
+        return image
+    return prepare_image(image)
@@ -0,0 +1,122 @@
+import os
+import re
+
+from metrics import INCREMENTAL_VERDICTS, endpoint_label
+
+# Default for the `incremental` flag on the batch/stream endpoints (session requests only)
+INCREMENTAL_EVALUATION = os.environ.get("INCREMENTAL_EVALUATION", "0") == "1"
+# Perceptual hash distance (bits out of 64) to the previous round's image: at or below
+# UNCHANGED every verdict carries over, above MAX the image counts as new and all re-run
+INCREMENTAL_UNCHANGED_DISTANCE = int(os.environ.get("INCREMENTAL_UNCHANGED_DISTANCE", "2"))
+INCREMENTAL_MAX_DISTANCE = int(os.environ.get("INCREMENTAL_MAX_DISTANCE", "16"))
+# A right swipe with overall_swipeability at or above this (or a left swipe at or
+# below 11 minus it) is stable; anything in between is borderline and re-runs
+INCREMENTAL_STABLE_SCORE = int(os.environ.get("INCREMENTAL_STABLE_SCORE", "8"))
+# Share of the words in a persona's `change` request that must appear in the round's
+# suggestions for the new image to count as targeting that persona
+INCREMENTAL_TARGET_OVERLAP = float(os.environ.get("INCREMENTAL_TARGET_OVERLAP", "0.4"))
+
+_WORD = re.compile(r"[a-z]{4,}")
+_STOPWORDS = frozenset(
+    "that this with from have more less would could should make your their there them than "
+    "into just some very much what when which while also about like please".split()
+)
+
+
+def _words(text):
+    return {w for w in _WORD.findall(str(text or "").lower()) if w not in _STOPWORDS}
+
+
+def _suggestion_words(suggestions):
+    if not isinstance(suggestions, dict):
+        return set()
+    parts = [suggestions.get("prompt", "")]
+    if isinstance(suggestions.get("priority_changes"), list):
+        parts.extend(suggestions["priority_changes"])
+    return _words(" ".join(str(p) for p in parts))
+
+
+def _is_stable(verdict):
+    scores = verdict.get("scores")
+    score = scores.get("overall_swipeability") if isinstance(scores, dict) else None
+    if not isinstance(score, (int, float)):
+        return False
+    if verdict.get("swipe") == "right":
+        return score >= INCREMENTAL_STABLE_SCORE
+    if verdict.get("swipe") == "left":
+        return score <= 11 - INCREMENTAL_STABLE_SCORE
+    return False
+
+
+def _is_targeted(verdict, suggested):
+    wanted = _words(verdict.get("change"))
+    if not wanted or not suggested:
+        return False
+    return len(wanted & suggested) / len(wanted) >= INCREMENTAL_TARGET_OVERLAP
+
+
+class ReevaluationPlan:
+    """
+    Which verdicts of the previous round carry over to the current one.
+    `carried` maps panel index -> verdict (already marked as carried over),
+    `fresh` lists the panel indexes to evaluate, `decisions` the reason per index.
+    """
+
+    def __init__(self, from_round, distance):
+        self.from_round = from_round
+        self.distance = distance
+        self.carried = {}
+        self.fresh = []
+        self.decisions = {}
+
+    def to_dict(self):
+        counts = {}
+        for decision in self.decisions.values():
+            counts[decision] = counts.get(decision, 0) + 1
+        return {
+            "fromRound": self.from_round,
+            "distance": self.distance,
+            "carried": len(self.carried),
+            "fresh": len(self.fresh),
+            "decisions": counts,
+        }
+
+
+def plan_reevaluation(panel, previous, distance):
+    """
+    Decide per persona whether its verdict on the `previous` round's image still
+    holds for an image `distance` bits away (None if either hash is unknown).
+    Verdicts only carry over when the persona's prompt is unchanged; then an
+    unchanged image keeps every verdict, while a similar one keeps those that
+    were stable and whose requested change the round's suggestions did not target.
+    """
+    plan = ReevaluationPlan(previous.number if previous else None, distance)
+    suggested = _suggestion_words(previous.suggestions) if previous else set()
+
+    for index, persona in enumerate(panel):
+        key = str(persona.id)
+        verdict = previous.verdicts.get(key) if previous else None
+        if verdict is None or previous.prompt_hashes.get(key) != persona.prompt_hash:
+            decision = "no_previous"
+        elif distance is None or distance > INCREMENTAL_MAX_DISTANCE:
+            decision = "new_image"
+        elif distance <= INCREMENTAL_UNCHANGED_DISTANCE:
+            decision = "unchanged"
+        elif _is_targeted(verdict, suggested):
+            decision = "targeted"
+        elif _is_stable(verdict):
+            decision = "stable"
+        else:
+            decision = "borderline"
+
+        plan.decisions[index] = decision
+        INCREMENTAL_VERDICTS.labels(decision, endpoint_label()).inc()
+        if decision in ("unchanged", "stable"):
+            plan.carried[index] = {
+                **verdict,
+                "carriedOver": True,
+                "carriedFrom": verdict.get("carriedFrom") or previous.number,
+            }
+        else:
+            plan.fresh.append(index)
+    return plan
@@ -0,0 +1,259 @@
+import asyncio
+import contextvars
+import logging
+import os
+import time
+import uuid
+
+from state import shared_state
+
+logger = logging.getLogger(__name__)
+
+# Background job pool for long-running work (image generation)
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", "32"))
+# Finished jobs and their results are dropped after this many seconds
+JOB_TTL = float(os.environ.get("JOB_TTL", "1800"))
+JOB_CLEANUP_INTERVAL = float(os.environ.get("JOB_CLEANUP_INTERVAL", "60"))
+# How often a worker that doesn't own a job re-reads its shared snapshot for events
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "0.5"))
+
+TERMINAL_STATES = ("done", "failed")
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    """
+    One unit of background work. Progress is published to subscribers as
+    (event, data) pairs; `result` and `error` hold the final outcome. Every
+    change is also saved to the shared state so other workers can serve it.
+    """
+
+    def __init__(self, runner, context, state=None):
+        self.id = uuid.uuid4().hex
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.progress = []
+        self._runner = runner
+        # Context of the submitting request (client identity, metrics labels)
+        self._context = context
+        self._subscribers = set()
+        self._state = state
+
+    async def publish(self, event, data):
+        if event == "progress":
+            self.progress.append(data)
+        for subscriber in self._subscribers:
+            subscriber.put_nowait((event, data))
+        await self.save()
+
+    async def save(self):
+        if self._state is None:
+            return
+        try:
+            await self._state.set("jobs", self.id, self.to_dict(), JOB_TTL)
+        except Exception as e:
+            logger.error(f"[JOBS] Could not save job {self.id}: {e}")
+
+    def subscribe(self):
+        subscriber = asyncio.Queue()
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self._subscribers.discard(subscriber)
+
+    def to_dict(self):
+        return {
+            "jobId": self.id,
+            "status": self.status,
+            "createdAt": self.created_at,
+            "startedAt": self.started_at,
+            "finishedAt": self.finished_at,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """
+    Bounded queue drained by a fixed pool of worker tasks, with TTL cleanup of
+    finished jobs. Jobs run in the process that accepted them; their snapshots
+    in the shared state let any process report on them.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, queue_size=JOB_QUEUE_SIZE, ttl=JOB_TTL, state=None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.ttl = ttl
+        self.state = state
+        self.jobs = {}
+        self._queue = None
+        self._tasks = []
+        self._running = set()
+        self._closing = False
+
+    async def start(self):
+        self._closing = False
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._cleanup_loop()))
+
+    async def stop(self, drain_timeout=0):
+        """
+        Stop accepting jobs, fail the ones still queued, give running jobs up to
+        `drain_timeout` seconds to finish, then cancel whatever is left.
+        """
+        self._closing = True
+        while self._queue is not None and not self._queue.empty():
+            job = self._queue.get_nowait()
+            self._queue.task_done()
+            job.status = "failed"
+            job.error = {"status": 503, "detail": "Server shutting down"}
+            job.finished_at = time.time()
+            await job.publish(job.status, job.to_dict())
+        if self._running and drain_timeout > 0:
+            logger.info(f"[JOBS] Draining {len(self._running)} running job(s)")
+            await asyncio.wait(self._running, timeout=drain_timeout)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, runner):
+        """
+        Queue `runner(job)` for background execution and return the Job.
+        Raises JobQueueFull when the backlog is at capacity or shutting down.
+        """
+        if self._closing:
+            raise JobQueueFull("Server is shutting down")
+        # Snapshots are only worth writing when another process could read them
+        state = self.state if self.state is not None and self.state.shared else None
+        job = Job(runner, contextvars.copy_context(), state)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFull(f"Job queue is full ({self.queue_size} pending)")
+        self.jobs[job.id] = job
+        await job.save()
+        return job
+
+    async def get(self, job_id):
+        """
+        The job as a dict, from this process or the shared state; None if unknown.
+        """
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if self.state is None or not self.state.shared:
+            return None
+        return await self.state.get("jobs", job_id)
+
+    async def watch(self, job_id):
+        """
+        Yield (event, data): a `snapshot`, then `status`/`progress` events,
+        ending with `done` or `failed`. Jobs owned by another worker are
+        followed by polling their shared snapshot.
+        """
+        job = self.jobs.get(job_id)
+        if job is not None:
+            subscriber = job.subscribe()
+            try:
+                yield "snapshot", job.to_dict()
+                if job.status in TERMINAL_STATES:
+                    yield job.status, job.to_dict()
+                    return
+                while True:
+                    event, data = await subscriber.get()
+                    yield event, data
+                    if event in TERMINAL_STATES:
+                        return
+            finally:
+                job.unsubscribe(subscriber)
+
+        snapshot = await self.get(job_id)
+        if snapshot is None:
+            return
+        yield "snapshot", snapshot
+        seen_progress = len(snapshot["progress"])
+        status = snapshot["status"]
+        while status not in TERMINAL_STATES:
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            snapshot = await self.get(job_id)
+            if snapshot is None:
+                yield "failed", {"jobId": job_id, "status": "failed", "error": {"status": 404, "detail": "Job expired"}}
+                return
+            for progress in snapshot["progress"][seen_progress:]:
+                yield "progress", progress
+            seen_progress = len(snapshot["progress"])
+            if snapshot["status"] != status:
+                status = snapshot["status"]
+                if status not in TERMINAL_STATES:
+                    yield "status", {"status": status}
+        yield status, snapshot
+
+    async def _run(self, job):
+        job.status = "running"
+        job.started_at = time.time()
+        await job.publish("status", {"status": job.status})
+        try:
+            job.result = await job._runner(job)
+            job.status = "done"
+        except asyncio.CancelledError:
+            job.status = "failed"
+            job.error = {"status": 503, "detail": "Job cancelled during shutdown"}
+            raise
+        except Exception as e:
+            job.status = "failed"
+            job.error = {"status": getattr(e, "status_code", 500), "detail": str(e)}
+            logger.error(f"[JOBS] Job {job.id} failed: {e}")
+        finally:
+            job.finished_at = time.time()
+            job._runner = None
+            await job.publish(job.status, job.to_dict())
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                # Run inside the submitting request's context so per-client
+                # scheduling and metrics labels still apply
+                task = job._context.run(asyncio.create_task, self._run(job))
+                self._running.add(task)
+                try:
+                    await task
+                finally:
+                    self._running.discard(task)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[JOBS] Worker error on job {job.id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def cleanup(self):
+        cutoff = time.time() - self.ttl
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job.status in TERMINAL_STATES and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+        if expired:
+            logger.info(f"[JOBS] Removed {len(expired)} expired job(s)")
+
+    async def _cleanup_loop(self):
+        while True:
+            await asyncio.sleep(JOB_CLEANUP_INTERVAL)
+            self.cleanup()
+
+
+job_manager = JobManager(state=shared_state)
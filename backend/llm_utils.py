@@ -1,18 +1,89 @@
 import os
-import requests
+import asyncio
 import json
-import base64
 import httpx
 import logging
-import random
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from aggregation import FeedbackSummary
+from cache import combine_cache, evaluation_cache, evaluation_cache_key
+from image_utils import as_prepared
+from personas import EVALUATION_CRITERIA, VERDICT_FIELDS, as_persona
+from upstream import UpstreamError, encode_payload, post_chat_completion
+from hedging import HEDGE_ENABLED, HedgePolicy, hedged_call
+from log_config import log_body
+from metrics import GENERATED_IMAGES, JSON_PARSE_FALLBACKS, JSON_PARSE_SECONDS, endpoint_label, persona_label, timed
+
 logger = logging.getLogger(__name__)
 
+EVALUATE_MODEL = "openai/gpt-4o-mini"
+COMBINE_MODEL = "openai/gpt-4o-mini"
+
+# Latency history and hedge budget for per-persona evaluation calls
+evaluate_hedge_policy = HedgePolicy("EVALUATE")
+
+# Connection pool tuning for the shared OpenRouter client
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP2_ENABLED = os.environ.get("HTTP2_ENABLED", "1") not in ("0", "false", "False")
+
+# Image generation: parallelism per request, cap across all requests, and per-attempt timeout
+GENERATE_CONCURRENCY = int(os.environ.get("GENERATE_CONCURRENCY", "4"))
+GENERATE_GLOBAL_LIMIT = int(os.environ.get("GENERATE_GLOBAL_LIMIT", "8"))
+GENERATE_ATTEMPT_TIMEOUT = float(os.environ.get("GENERATE_ATTEMPT_TIMEOUT", "60"))
+
+_generation_semaphore = None
+
+
+def _generation_slots():
+    """
+    Process-wide semaphore bounding in-flight image generations across requests.
+    """
+    global _generation_semaphore
+    if _generation_semaphore is None:
+        _generation_semaphore = asyncio.Semaphore(GENERATE_GLOBAL_LIMIT)
+    return _generation_semaphore
+
+
+def create_http_client():
+    """
+    Build the application-lifetime client used for every OpenRouter call.
+    HTTP/2 is used when the optional `h2` package is installed.
+    """
+    http2 = HTTP2_ENABLED
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("[HTTP] h2 not installed, falling back to HTTP/1.1")
+            http2 = False
+
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    # Calls override the read/write/pool timeouts per request but keep this connect timeout
+    timeout = httpx.Timeout(60.0, connect=HTTP_CONNECT_TIMEOUT)
+    return httpx.AsyncClient(http2=http2, limits=limits, timeout=timeout)
+
+
+@asynccontextmanager
+async def _client_scope(client):
+    """
+    Yield the shared client if one was injected, otherwise a short-lived one.
+    """
+    if client is not None:
+        yield client
+        return
+    async with httpx.AsyncClient() as own_client:
+        yield own_client
+
 
 def _resolve_api_key(api_key):
     """
@@ -23,70 +94,71 @@ def _resolve_api_key(api_key):
     
     env_key = os.environ.get("OPENROUTER_API_KEY")
     if env_key:
-        logger.info("[API_KEY] Using default API key from OPENROUTER_API_KEY environment variable")
+        logger.debug("[API_KEY] Using default API key from OPENROUTER_API_KEY environment variable")
         return env_key
     
     raise ValueError("No API key provided and OPENROUTER_API_KEY environment variable is not set")
 
 
-async def evaluate_image_with_persona(image_bytes, persona, api_key):
-    api_key = _resolve_api_key(api_key)
-    # Encode image
-    base64_image = base64.b64encode(image_bytes).decode('utf-8')
-
-    system_prompt = f"""
-    You are `{persona['name']}` with this personality: `{persona['bio']}`.
-    You must think and respond as this specific person would - with their unique preferences, dealbreakers, and taste.
-
-    ## EVALUATION CRITERIA
-    Analyze these specific aspects of the Tinder profile picture:
-
-    1. **First Impression** (0-3 seconds): What emotion does this photo trigger immediately?
-    2. **Face & Expression**: Is the face clearly visible? Genuine smile vs forced? Eye contact?
-    3. **Body Language**: Confident? Approachable? Awkward? Open or closed posture?
-    4. **Setting/Background**: Interesting? Distracting? Does it tell a story about lifestyle?
-    5. **Photo Quality**: Lighting quality, resolution, angles, selfie vs someone else took it
-    6. **Outfit & Grooming**: Effort level, style match, cleanliness, appropriateness
-    7. **Authenticity**: Does it feel staged/try-hard or natural/effortless?
-    8. **Red Flags**: Group photos, bathroom selfies, exes cropped out, sunglasses hiding face, etc.
-
-    ## YOUR TASK
-    Based on YOUR CHARACTER's specific preferences and personality, decide: Would YOU swipe RIGHT or LEFT?
-
-    Remember:
-    - What would SPECIFICALLY attract YOUR character type?
-    - What are YOUR dealbreakers based on your personality?
-    - Don't give generic advice - filter everything through YOUR unique perspective.
-
-    ## OUTPUT FORMAT
-    Respond with ONLY this JSON object:
-    {{
-        "swipe": "left" or "right",
-        "first_impression": "One sentence - your gut reaction in the first 3 seconds",
-        "reason": "2-3 sentences explaining WHY you swiped this way, from your character's perspective",
-        "likes": "Be SPECIFIC - not 'nice smile' but 'the genuine laugh lines around the eyes show authenticity'",
-        "dislikes": "Be SPECIFIC - not 'bad lighting' but 'harsh overhead lighting creates unflattering shadows under the eyes'",
-        "keep": "The ONE element that works best and should absolutely stay",
-        "change": "The ONE change that would have the biggest positive impact on your decision",
-        "scores": {{
-            "attractiveness": 1-10,
-            "authenticity": 1-10,
-            "photo_quality": 1-10,
-            "overall_swipeability": 1-10
-        }}
-    }}
+def _build_evaluation(persona, swipe, first_impression, reason, likes, dislikes, keep, change, scores):
+    """
+    Assemble the verdict returned to clients, including the text summary in `content`.
     """
-    logger.info(f"[EVALUATE] System Prompt:\n{system_prompt}")
+    # Build content summary
+    content_parts = []
+    if first_impression:
+        content_parts.append(f"First Impression: {first_impression}")
+    if reason:
+        content_parts.append(f"Reason: {reason}")
+    if likes:
+        content_parts.append(f"Likes: {likes}")
+    if dislikes:
+        content_parts.append(f"Dislikes: {dislikes}")
+    if keep:
+        content_parts.append(f"Keep: {keep}")
+    if change:
+        content_parts.append(f"Change: {change}")
     
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "http://localhost:3000", 
-    }
+    full_content = '\n'.join(content_parts)
     
+    return {
+        "personaId": persona.id, 
+        'name': persona.name,
+        "swipe": swipe,
+        "first_impression": first_impression,
+        "reason": reason,
+        "likes": likes,
+        "dislikes": dislikes,
+        "keep": keep,
+        "change": change,
+        "scores": scores,
+        "content": full_content,
+    }
+
+
+async def evaluate_image_with_persona(image, persona, api_key, client=None, hedge=False):
+    """
+    `image` is raw bytes or a PreparedImage; callers fanning out over a panel
+    prepare it once and pass the same instance to every persona.
+    `persona` is a personas.Persona, or a dict resolved through the registry.
+    `hedge` sends a duplicate request for stragglers (interactive paths only).
+    """
+    api_key = _resolve_api_key(api_key)
+    image = as_prepared(image)
+    persona = as_persona(persona)
+
+    # Serve repeat evaluations of the same image/persona/model from cache
+    cache_key = None
+    if evaluation_cache is not None:
+        cache_key = evaluation_cache_key(image.sha256, persona.prompt_hash, EVALUATE_MODEL)
+        cached = await evaluation_cache.get(cache_key, persona)
+        if cached is not None:
+            logger.info(f"[EVALUATE] Cache hit for persona {persona.name} (ID: {persona.id})")
+            return {**cached, "personaId": persona.id, "name": persona.name}
+
+    system_prompt = persona.system_prompt
     data = {
-        "model": "openai/gpt-4o-mini",
+        "model": EVALUATE_MODEL,
         "messages": [
             {
                 "role": "system",
@@ -95,7 +167,7 @@ async def evaluate_image_with_persona(image_bytes, persona, api_key):
             {
                 "role": "user",
                 "content": [
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
+                    {"type": "image_url", "image_url": {"url": image}}
                 ]
             }
         ],
@@ -103,26 +175,32 @@ async def evaluate_image_with_persona(image_bytes, persona, api_key):
     }
     
     # Log request details (without image for readability)
-    logger.info(f"[EVALUATE] === Starting Evaluation ===")
-    logger.info(f"[EVALUATE] Persona: {persona['name']} (ID: {persona['id']})")
-    logger.info(f"[EVALUATE] Persona Bio: {persona['bio']}")
-    logger.info(f"[EVALUATE] Model: {data['model']}")
-    logger.info(f"[EVALUATE] System Prompt:\n{system_prompt}")
-    logger.info(f"[EVALUATE] User Message: [IMAGE - not logged]")
-    
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, headers=headers, json=data, timeout=30.0)
-        result = response.json()
-    
-    # Log response (without image data)
-    logger.info(f"[EVALUATE] Response Status: {response.status_code}")
-    
-    content = result['choices'][0]['message']['content']
-    logger.info(f"[EVALUATE] Raw LLM Response:\n{content}")
+    logger.info(
+        f"[EVALUATE] Starting evaluation for persona {persona.id}",
+        extra={"persona_id": persona.id, "model": data['model'], "hedge": hedge},
+    )
+    log_body(logger, "EVALUATE", "System Prompt", system_prompt)
+    
+    # Serialize once; a hedged duplicate reuses the same body
+    body = encode_payload(data)
+    async with _client_scope(client) as http:
+        result = await hedged_call(
+            lambda on_admitted: post_chat_completion(
+                http, api_key, body, timeout=30.0, tag="EVALUATE", on_admitted=on_admitted
+            ),
+            evaluate_hedge_policy,
+            hedge=hedge and HEDGE_ENABLED,
+        )
+    
+    content = result['choices'][0]['message'].get('content') or ""
+    log_body(logger, "EVALUATE", "Raw LLM Response", content)
     
     # Parse the JSON response
+    parsed_ok = False
     try:
-        parsed = json.loads(content)
+        with timed(JSON_PARSE_SECONDS, "evaluate", endpoint_label()):
+            parsed = json.loads(content)
+        parsed_ok = True
         swipe = parsed.get("swipe", None)
         first_impression = parsed.get("first_impression", "")
         reason = parsed.get("reason", "No reason provided")
@@ -132,18 +210,13 @@ async def evaluate_image_with_persona(image_bytes, persona, api_key):
         change = parsed.get("change", "")
         scores = parsed.get("scores", {})
         
-        logger.info(f"[EVALUATE] Parsed Response:")
-        logger.info(f"[EVALUATE]   Swipe: {swipe}")
-        logger.info(f"[EVALUATE]   First Impression: {first_impression}")
-        logger.info(f"[EVALUATE]   Reason: {reason}")
-        logger.info(f"[EVALUATE]   Likes: {likes}")
-        logger.info(f"[EVALUATE]   Dislikes: {dislikes}")
-        logger.info(f"[EVALUATE]   Keep: {keep}")
-        logger.info(f"[EVALUATE]   Change: {change}")
-        logger.info(f"[EVALUATE]   Scores: {scores}")
+        logger.info(
+            f"[EVALUATE] Persona {persona.id} swiped {swipe}",
+            extra={"persona_id": persona.id, "swipe": swipe, "scores": scores},
+        )
     except json.JSONDecodeError as e:
-        logger.error(f"[EVALUATE] JSONDecodeError: {e}")
-        logger.error(f"[EVALUATE] Failed to parse content: {content}")
+        logger.error(f"[EVALUATE] JSONDecodeError: {e}", extra={"persona_id": persona.id, "chars": len(content)})
+        JSON_PARSE_FALLBACKS.labels("evaluate", persona_label(persona), endpoint_label()).inc()
         swipe = "left"
         first_impression = ""
         reason = ""
@@ -153,55 +226,168 @@ async def evaluate_image_with_persona(image_bytes, persona, api_key):
         change = ""
         scores = {}
     
-    # Build content summary
-    content_parts = []
-    if first_impression:
-        content_parts.append(f"First Impression: {first_impression}")
-    if reason:
-        content_parts.append(f"Reason: {reason}")
-    if likes:
-        content_parts.append(f"Likes: {likes}")
-    if dislikes:
-        content_parts.append(f"Dislikes: {dislikes}")
-    if keep:
-        content_parts.append(f"Keep: {keep}")
-    if change:
-        content_parts.append(f"Change: {change}")
+    evaluation = _build_evaluation(persona, swipe, first_impression, reason, likes, dislikes, keep, change, scores)
     
-    full_content = '\n'.join(content_parts)
-    
-    return {
-        "personaId": persona['id'], 
-        'name': persona['name'],
-        "swipe": swipe,
-        "first_impression": first_impression,
-        "reason": reason,
-        "likes": likes,
-        "dislikes": dislikes,
-        "keep": keep,
-        "change": change,
-        "scores": scores,
-        "content": full_content,
+    # Only cache verdicts the model actually produced, not the parse-failure fallback
+    if cache_key is not None and parsed_ok:
+        await evaluation_cache.set(cache_key, evaluation)
+
+    return evaluation
+
+def _parse_panel_verdict(entry):
+    """
+    Validate one verdict from the panel response. Returns the field tuple for
+    _build_evaluation, or None if the entry is malformed.
+    """
+    if not isinstance(entry, dict) or entry.get("swipe") not in ("left", "right"):
+        return None
+    scores = entry.get("scores", {})
+    if not isinstance(scores, dict):
+        return None
+    text_fields = ["first_impression", "reason", "likes", "dislikes", "keep", "change"]
+    if any(not isinstance(entry.get(k, ""), str) for k in text_fields):
+        return None
+    return (
+        entry["swipe"],
+        entry.get("first_impression", ""),
+        entry.get("reason", "No reason provided"),
+        entry.get("likes", ""),
+        entry.get("dislikes", ""),
+        entry.get("keep", ""),
+        entry.get("change", ""),
+        scores,
+    )
+
+
+async def evaluate_image_with_panel(image, personas, api_key, client=None):
+    """
+    Judge the image for every persona in a single vision call.
+    Returns a list aligned with `personas`: a verdict dict, or None for any persona
+    missing or malformed in the response so the caller can fall back to
+    evaluate_image_with_persona for it.
+    """
+    api_key = _resolve_api_key(api_key)
+    image = as_prepared(image)
+    personas = [as_persona(p) for p in personas]
+
+    verdicts = [None] * len(personas)
+    cache_keys = [None] * len(personas)
+    if evaluation_cache is not None:
+        for i, persona in enumerate(personas):
+            cache_keys[i] = evaluation_cache_key(image.sha256, persona.prompt_hash, EVALUATE_MODEL, "single_call")
+            cached = await evaluation_cache.get(cache_keys[i], persona)
+            if cached is not None:
+                verdicts[i] = {**cached, "personaId": persona.id, "name": persona.name}
+
+    pending = [i for i, v in enumerate(verdicts) if v is None]
+    if not pending:
+        return verdicts
+
+    # Personas are addressed by position so arbitrary ids survive the round trip
+    persona_text = "\n".join(
+        f"    - key `{i}`: {personas[i].panel_text}"
+        for i in pending
+    )
+    system_prompt = f"""
+    You are a panel of different people judging the same Tinder profile picture.
+    Each panelist must think and respond as that specific person would - with their unique preferences, dealbreakers, and taste.
+    Judge independently: panelists do not see each other's verdicts.
+
+    ## PANELISTS
+{persona_text}
+
+    ## EVALUATION CRITERIA
+    Each panelist analyzes these specific aspects of the Tinder profile picture:
+
+    {EVALUATION_CRITERIA}
+
+    ## YOUR TASK
+    For EACH panelist, based on THEIR specific preferences and personality, decide: Would THEY swipe RIGHT or LEFT?
+    Don't give generic advice - filter everything through each panelist's unique perspective.
+
+    ## OUTPUT FORMAT
+    Respond with ONLY this JSON object, with exactly one verdict per panelist key:
+    {{
+        "verdicts": [
+            {{
+        "key": "the panelist key",
+{VERDICT_FIELDS}
+            }}
+        ]
+    }}
+    """
+
+    data = {
+        "model": EVALUATE_MODEL,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {
+                "role": "user",
+                "content": [
+                    {"type": "image_url", "image_url": {"url": image}}
+                ]
+            }
+        ],
+        "response_format": {"type": "json_object"}
     }
 
-async def combine_feedback(feedbacks, api_key, goal):
+    logger.info(
+        f"[EVALUATE_PANEL] Starting panel evaluation: {len(pending)} uncached of {len(personas)} personas",
+        extra={"model": data['model']},
+    )
+    log_body(logger, "EVALUATE_PANEL", "System Prompt", system_prompt)
+
+    async with _client_scope(client) as http:
+        result = await post_chat_completion(http, api_key, data, timeout=60.0, tag="EVALUATE_PANEL")
+
+    try:
+        content = result['choices'][0]['message']['content']
+        with timed(JSON_PARSE_SECONDS, "evaluate_panel", endpoint_label()):
+            entries = json.loads(content).get("verdicts", [])
+    except (KeyError, IndexError, TypeError, AttributeError, json.JSONDecodeError) as e:
+        logger.error(f"[EVALUATE_PANEL] Unusable panel response, falling back for all personas: {e}")
+        JSON_PARSE_FALLBACKS.labels("evaluate_panel", "panel", endpoint_label()).inc()
+        return verdicts
+
+    if not isinstance(entries, list):
+        entries = []
+    for entry in entries:
+        key = str(entry.get("key", "")) if isinstance(entry, dict) else ""
+        if not key.isdigit() or int(key) not in pending or verdicts[int(key)] is not None:
+            continue
+        fields = _parse_panel_verdict(entry)
+        if fields is None:
+            continue
+        i = int(key)
+        verdicts[i] = _build_evaluation(personas[i], *fields)
+        if cache_keys[i] is not None:
+            await evaluation_cache.set(cache_keys[i], verdicts[i])
+
+    missing = sum(1 for i in pending if verdicts[i] is None)
+    logger.info(f"[EVALUATE_PANEL] Parsed {len(pending) - missing}/{len(pending)} verdicts, {missing} need fallback")
+    return verdicts
+
+
+async def combine_feedback(feedbacks, api_key, goal, client=None):
+    """
+    Turn the panel's verdicts into one image generation prompt. Feedback is
+    pre-aggregated locally (consensus, average scores, merged statements in a
+    seeded canonical order), so identical panels send identical prompts and
+    repeats are served from the combine cache.
+    """
     api_key = _resolve_api_key(api_key)
-    logger.info(f"[COMBINE] === Starting Feedback Combination ===")
-    logger.info(f"[COMBINE] Number of feedbacks: {len(feedbacks)}")
-    
-    # Aggregator - shuffle to prevent order bias
-    random.shuffle(feedbacks)
-    feedback_text = ''
-    for persona in feedbacks:
-        persona_full_str = ""
-        for k, v in persona.items():
-            persona_full_str += f"{k}: {v}\n"
-        feedback_text += persona_full_str + "\n---\n"
-    
-    # Calculate consensus metrics
-    right_swipes = sum(1 for f in feedbacks if f.get('swipe') == 'right')
-    left_swipes = sum(1 for f in feedbacks if f.get('swipe') == 'left')
-    total = len(feedbacks)
+    summary = FeedbackSummary(feedbacks, goal, COMBINE_MODEL)
+    logger.info("[COMBINE] Starting feedback combination", extra={"feedbacks": summary.total, "goal": goal})
+
+    if combine_cache is not None:
+        cached = await combine_cache.get(summary.key)
+        if cached is not None:
+            logger.info(f"[COMBINE] Cache hit for {summary.total} feedbacks")
+            return cached
+
+    right_swipes = summary.right
+    left_swipes = summary.left
+    total = summary.total
     
     goal_strategy = """
     ## STRATEGY FOR MORE RIGHT SWIPES:
@@ -278,25 +464,16 @@ async def combine_feedback(feedbacks, api_key, goal):
         "consensus_keeps": ["Element to keep 1", "Element to keep 2"]
     }}
     """
-    logger.info(f"[COMBINE] System Prompt:\n{system_prompt}")
-    
     prompt = f"""
-    Here is feedback from different people about a Tinder profile picture:
+    Here is aggregated feedback from {total} different people about a Tinder profile picture.
+    Points several people made are merged and counted:
     ```
-    {feedback_text}
+    {summary.render()}
     ```
     """
-    logger.info(f"[COMBINE] User Prompt:\n{prompt}")
      
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-         "HTTP-Referer": "http://localhost:3000", 
-    }
-    
     data = {
-        "model": "openai/gpt-4o-mini",
+        "model": COMBINE_MODEL,
         "messages": [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": prompt}
@@ -304,68 +481,49 @@ async def combine_feedback(feedbacks, api_key, goal):
         "response_format": {"type": "json_object"}
     }
     
-    logger.info(f"[COMBINE] Model: {data['model']}")
-    logger.info(f"[COMBINE] System Prompt:\n{system_prompt}")
-    logger.info(f"[COMBINE] User Prompt:\n{prompt}")
+    log_body(logger, "COMBINE", "System Prompt", system_prompt)
+    log_body(logger, "COMBINE", "User Prompt", prompt)
     
-    try:
-        async with httpx.AsyncClient() as client:
-            logger.info(f"[COMBINE] Sending request to OpenRouter API...")
-            response = await client.post(url, headers=headers, json=data, timeout=60.0)
-            result = response.json()
-    except httpx.TimeoutException as e:
-        logger.error(f"[COMBINE] Request timed out: {e}")
-        raise Exception(f"OpenRouter API request timed out: {e}")
-    except httpx.RequestError as e:
-        logger.error(f"[COMBINE] Request error: {e}")
-        raise Exception(f"OpenRouter API request failed: {e}")
-    except Exception as e:
-        logger.error(f"[COMBINE] Unexpected error during API call: {e}")
-        raise
-
-    logger.info(f"[COMBINE] Response Status: {response.status_code}")
+    async with _client_scope(client) as http:
+        result = await post_chat_completion(http, api_key, data, timeout=60.0, tag="COMBINE")
     
-    # Check for API errors
-    if 'error' in result:
-        logger.error(f"[COMBINE] API Error: {result['error']}")
-        raise Exception(f"OpenRouter API error: {result['error']}")
-    
-    if 'choices' not in result or not result['choices']:
-        logger.error(f"[COMBINE] Unexpected response format: {result}")
-        raise Exception(f"Unexpected API response format: {result}")
-    
-    content = result['choices'][0]['message']['content']
-    logger.info(f"[COMBINE] Raw Response:\n{content}")
+    content = result['choices'][0]['message'].get('content') or ""
+    log_body(logger, "COMBINE", "Raw Response", content)
     
     # Parse the JSON response
     try:
-        parsed = json.loads(content)
+        with timed(JSON_PARSE_SECONDS, "combine", endpoint_label()):
+            parsed = json.loads(content)
         thinking = parsed.get("thinking", "")
         prompt_text = parsed.get("prompt", "")
-        logger.info(f"[COMBINE] Parsed Thinking:\n{thinking}")
-        logger.info(f"[COMBINE] Parsed Prompt:\n{prompt_text}")
+        logger.info("[COMBINE] Parsed response", extra={"prompt_chars": len(prompt_text), "thinking_chars": len(thinking)})
     except json.JSONDecodeError as e:
-        logger.error(f"[COMBINE] JSONDecodeError: {e}")
-        logger.error(f"[COMBINE] Failed to parse content: {content}")
+        logger.error(f"[COMBINE] JSONDecodeError: {e}", extra={"chars": len(content)})
+        JSON_PARSE_FALLBACKS.labels("combine", "none", endpoint_label()).inc()
         # Fallback: use entire content as prompt
-        thinking = ""
-        prompt_text = content
-    
-    return {"thinking": thinking, "prompt": prompt_text}
+        return {"thinking": "", "prompt": content}
+
+    result = {"thinking": thinking, "prompt": prompt_text}
+    for key in ("priority_changes", "consensus_keeps"):
+        if isinstance(parsed.get(key), list):
+            result[key] = parsed[key]
+    if combine_cache is not None:
+        await combine_cache.set(summary.key, result)
+    return result
 
-async def generate_new_images(suggestions, api_key, count=4, original_image=None):
+async def generate_new_images(suggestions, api_key, count=4, original_image=None, client=None, on_image=None, store_image=None):
+    """
+    Generate `count` candidate images concurrently. `on_image`, if given, is awaited
+    with each image URL as soon as its generation finishes. `store_image`, if given,
+    maps each returned image (usually a data URI) to the URL handed back instead.
+    """
     api_key = _resolve_api_key(api_key)
 
-    logger.info(f"[GENERATE] Suggestions: {suggestions}")
-    logger.info(f"[GENERATE] Count: {count}")
-    logger.info(f"[GENERATE] Has original image: {original_image is not None}")
-    
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "http://localhost:3000", 
-    }
+    logger.info(
+        f"[GENERATE] Starting generation of {count} image(s)",
+        extra={"count": count, "has_original": original_image is not None},
+    )
+    log_body(logger, "GENERATE", "Suggestions", suggestions)
     
     images = []
     
@@ -399,7 +557,7 @@ async def generate_new_images(suggestions, api_key, count=4, original_image=None
     """
     
     # Include original image for reference
-    base64_image = base64.b64encode(original_image).decode('utf-8')
+    original_image = as_prepared(original_image)
 
     data = {
         "model": "google/gemini-3-pro-image-preview",
@@ -411,37 +569,71 @@ async def generate_new_images(suggestions, api_key, count=4, original_image=None
             {
                 "role": "user",
                 "content": [
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
+                    {"type": "image_url", "image_url": {"url": original_image}}
                 ]
             }
         ],
         "modalities": ["image", "text"]
     }
-    
-    logger.info(f"[GENERATE] Model: {data['model']}")
-    
-    # Generate requested number of images
-    async with httpx.AsyncClient() as client:
-        for i in range(count):
-            try:
-                logger.info(f"[GENERATE] Generating image {i+1}/{count}...")
-                response = await client.post(url, headers=headers, json=data, timeout=60.0)
-                result = response.json()
-                # Log response without image data
-                has_images = bool(result.get("choices", [{}])[0].get("message", {}).get("images"))
-                logger.info(f"[GENERATE] Response {i+1}: status={response.status_code}, has_images={has_images}")
-                
-                if result.get("choices"):
-                    message = result["choices"][0]["message"]
-                    if message.get("images"):
-                        for img in message["images"]:
-                            images.append(img["image_url"]["url"])
-                    elif "content" in message and "http" in message["content"]: 
-                        # Fallback if image is in content url
-                        pass
-            except Exception as e:
-                logger.error(f"[GENERATE] Error generating image {i+1}: {e}")
-    
+    # Every candidate sends the same request; serialize it once
+    body = encode_payload(data)
+    
+    async def generate_one(http, i):
+        # Per-request slot first: only calls that can actually run hold a global
+        # slot, so one large request can't park every slot while it waits on itself
+        async with local_slots, _generation_slots():
+            logger.debug(f"[GENERATE] Generating image {i+1}/{count}...")
+            result = await post_chat_completion(
+                http, api_key, body, timeout=GENERATE_ATTEMPT_TIMEOUT, tag="GENERATE"
+            )
+        # Log response without image data
+        has_images = bool(result["choices"][0].get("message", {}).get("images"))
+        logger.debug(f"[GENERATE] Response {i+1}: has_images={has_images}")
+
+        urls = []
+        if result.get("choices"):
+            message = result["choices"][0]["message"]
+            if message.get("images"):
+                for img in message["images"]:
+                    urls.append(img["image_url"]["url"])
+            elif "http" in (message.get("content") or ""):
+                # Fallback if image is in content url
+                pass
+        if store_image is not None:
+            urls = [await store_image(url) for url in urls]
+        return urls
+
+    local_slots = asyncio.Semaphore(max(1, min(count, GENERATE_CONCURRENCY)))
+
+    # Generate requested number of images concurrently, collecting each as it completes
+    last_error = None
+    async with _client_scope(client) as http:
+        tasks = [asyncio.create_task(generate_one(http, i)) for i in range(count)]
+        try:
+            for future in asyncio.as_completed(tasks):
+                try:
+                    urls = await future
+                except UpstreamError as e:
+                    logger.error(f"[GENERATE] Error generating image: {e}")
+                    last_error = e
+                    continue
+                except Exception as e:
+                    logger.error(f"[GENERATE] Error generating image: {e}")
+                    continue
+                images.extend(urls)
+                GENERATED_IMAGES.labels(endpoint_label()).inc(len(urls))
+                if on_image is not None:
+                    for image_url in urls:
+                        await on_image(image_url)
+        finally:
+            # Cancel anything still running if the caller went away
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    # Partial success is fine; only surface the upstream failure when nothing came back
+    if not images and last_error is not None:
+        raise last_error
+
     logger.info(f"[GENERATE] Generated {len(images)} images from {count} API calls, returning all")
     return images
-
@@ -0,0 +1,124 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+
+# Output format: "json" (one object per line) or "text"
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# Per-category overrides, e.g. "EVALUATE=WARNING,UPSTREAM=DEBUG". The category is
+# the [TAG] prefix our log messages already start with.
+LOG_CATEGORY_LEVELS = os.environ.get("LOG_CATEGORY_LEVELS", "")
+# Prompt/response bodies are only logged for this fraction of calls, truncated
+LOG_BODY_SAMPLE_RATE = float(os.environ.get("LOG_BODY_SAMPLE_RATE", "0.01"))
+LOG_BODY_MAX_CHARS = int(os.environ.get("LOG_BODY_MAX_CHARS", "2000"))
+
+_TAG = re.compile(r"^\[([A-Z_]+)\]\s*")
+
+_listener = None
+
+
+def _parse_category_levels(spec):
+    levels = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, level = item.split("=", 1)
+        level = logging.getLevelName(level.strip().upper())
+        if isinstance(level, int):
+            levels[name.strip().upper()] = level
+    return levels
+
+
+class CategoryFilter(logging.Filter):
+    """
+    Sets `record.category` from the message's [TAG] prefix (or an explicit
+    extra) and drops records below that category's configured level, or below
+    `default` for categories without one. The root logger runs at the lowest
+    level in play, so overrides can lower a category's level as well as raise it.
+    """
+
+    def __init__(self, levels, default):
+        super().__init__()
+        self.levels = levels
+        self.default = default
+
+    def filter(self, record):
+        if not hasattr(record, "category"):
+            match = _TAG.match(str(record.msg))
+            record.category = match.group(1) if match else record.name
+        return record.levelno >= self.levels.get(record.category, self.default)
+
+
+class JsonFormatter(logging.Formatter):
+    _RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "category"}
+
+    def format(self, record):
+        message = record.getMessage()
+        payload = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "category": getattr(record, "category", record.name),
+            "msg": _TAG.sub("", message, count=1),
+        }
+        # Anything passed via extra= becomes a top-level field
+        for key, value in vars(record).items():
+            if key not in self._RESERVED:
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def setup_logging():
+    """
+    Route all logging through a QueueHandler so request handlers only enqueue
+    records; a background thread formats and writes them. Safe to call twice.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+
+    default_level = logging.getLevelName(LOG_LEVEL)
+    if not isinstance(default_level, int):
+        default_level = logging.INFO
+    levels = _parse_category_levels(LOG_CATEGORY_LEVELS)
+
+    records = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.addFilter(CategoryFilter(levels, default_level))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(min([default_level, *levels.values()]))
+    # Library chatter (per-request client logs, plugin loading) would otherwise flood our levels
+    for name in ("httpx", "httpcore", "hpack", "h2", "PIL", "asyncio", "multipart", "python_multipart"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def log_body(logger, category, label, body):
+    """
+    Log a prompt or response body at INFO for a sampled fraction of calls,
+    truncated to LOG_BODY_MAX_CHARS. Unsampled calls log only the body size at DEBUG.
+    """
+    body = body or ""
+    if random.random() >= LOG_BODY_SAMPLE_RATE:
+        logger.debug(f"[{category}] {label}: {len(body)} chars (not sampled)")
+        return
+    truncated = body if len(body) <= LOG_BODY_MAX_CHARS else body[:LOG_BODY_MAX_CHARS] + "...[truncated]"
+    logger.info(f"[{category}] {label}:\n{truncated}", extra={"sampled": True, "chars": len(body)})
@@ -1,25 +1,98 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 from dotenv import load_dotenv
+import asyncio
 import json
+import logging
 import os
+import shutil
+import tempfile
 
 # Load environment variables from .env file
 load_dotenv()
 
-from llm_utils import evaluate_image_with_persona, generate_new_images, combine_feedback
+from log_config import setup_logging
 
-app = FastAPI()
+setup_logging()
 
+from llm_utils import evaluate_image_with_persona, evaluate_image_with_panel, generate_new_images, combine_feedback, create_http_client, evaluate_hedge_policy
+from hedging import HEDGE_ENABLED
+from cache import combine_cache, evaluation_cache
+from image_utils import ImageTooLarge, hash_distance, perceptual_hash_async, prepare_image_async
+from uploads import UploadLimitMiddleware, spool_upload
+from upstream import UpstreamBadResponse, UpstreamError, QueueFullError, breaker_states
+from scheduler import ClientIdentityMiddleware, scheduler_stats
+from blob_store import BlobNotFound, blob_store, mime_type_for
+from sessions import SessionNotFound, prepared_images, session_store
+from jobs import JobQueueFull, job_manager
+from personas import PERSONAS_PATH, InvalidPersona, persona_registry
+from incremental import INCREMENTAL_EVALUATION, plan_reevaluation
+from state import WEB_CONCURRENCY, cleanup_loop as state_cleanup_loop, shared_state
+from metrics import IMAGE_ENCODE_SECONDS, MetricsMiddleware, endpoint_label, render_metrics, timed
+
+# Max persona calls in flight for a single /api/evaluate/batch request
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "8"))
+
+# Most images a single generate request may ask for, whoever's key it uses
+GENERATE_MAX_COUNT = int(os.environ.get("GENERATE_MAX_COUNT", "8"))
+
+# Public base URL for links to stored images; defaults to the request's own base URL
+PUBLIC_BASE_URL = os.environ.get("PUBLIC_BASE_URL", "")
+
+# "per_persona" = one vision call per judge, "single_call" = whole panel in one call
+EVALUATION_MODES = ("per_persona", "single_call")
+DEFAULT_EVALUATION_MODE = os.environ.get("EVALUATION_MODE", "per_persona")
+
+# Seconds to let in-flight requests and running jobs finish on shutdown before cancelling them
+SHUTDOWN_GRACE_PERIOD = float(os.environ.get("SHUTDOWN_GRACE_PERIOD", "30"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if not len(persona_registry):
+        # Every evaluate request would fail with an unknown persona; don't start half-working
+        raise RuntimeError(f"No personas loaded from {PERSONAS_PATH}; point PERSONAS_PATH at the personas JSON file")
+    # One pooled keep-alive client for all OpenRouter traffic
+    app.state.http_client = create_http_client()
+    await job_manager.start()
+    cleanups = [
+        asyncio.create_task(blob_store.cleanup_loop()),
+        asyncio.create_task(state_cleanup_loop()),
+    ]
+    try:
+        yield
+    finally:
+        for task in cleanups:
+            task.cancel()
+        # Uvicorn has already drained open requests; let background jobs finish their upstream calls
+        await job_manager.stop(drain_timeout=SHUTDOWN_GRACE_PERIOD)
+        await app.state.http_client.aclose()
+        await shared_state.close()
+
+
+def _http_client():
+    return getattr(app.state, "http_client", None)
+
+
+logger = logging.getLogger(__name__)
+
+app = FastAPI(lifespan=lifespan)
+
+# Innermost, so CORS headers still reach clients on a 413
+app.add_middleware(UploadLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "X-Queue-Position"],
 )
+app.add_middleware(ClientIdentityMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 class EvaluationRequest(BaseModel):
     openRouterKey: Optional[str] = None
@@ -27,69 +100,731 @@ class EvaluationRequest(BaseModel):
 
 class CombineRequest(BaseModel):
     openRouterKey: Optional[str] = None
-    goal: str = "right"  # "right" = want to be liked, "left" = want to be disliked
-    feedbacks: List[dict]
+    goal: Optional[str] = None  # "right" = want to be liked, "left" = want to be disliked
+    feedbacks: Optional[List[dict]] = None
+    sessionId: Optional[str] = None  # use the session's verdicts instead of `feedbacks`
 
 class GenerateRequest(BaseModel):
     openRouterKey: Optional[str] = None
     suggestions: str
 
+def _upstream_http_error(error):
+    """
+    Map a typed OpenRouter failure onto the HTTP status our clients should see.
+    """
+    headers = {}
+    if error.retry_after is not None:
+        headers["Retry-After"] = str(max(1, round(error.retry_after)))
+    if isinstance(error, QueueFullError):
+        headers["X-Queue-Position"] = str(error.queue_position)
+    return HTTPException(status_code=error.status_code, detail=error.detail, headers=headers)
+
+
 @app.get("/")
 def read_root():
     return {"Hello": "World"}
 
+@app.get("/metrics")
+def metrics_endpoint():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+# The stats endpoints below describe the worker that answered (named in X-Worker-Pid);
+# /metrics is the cross-worker view
+def _worker_header(response):
+    response.headers["X-Worker-Pid"] = str(os.getpid())
+
+@app.get("/api/cache/stats")
+async def cache_stats_endpoint(response: Response):
+    _worker_header(response)
+    stats = {"enabled": False} if evaluation_cache is None else {"enabled": True, **(await evaluation_cache.stats())}
+    stats["combine"] = {"enabled": False} if combine_cache is None else {"enabled": True, **(await combine_cache.stats())}
+    return stats
+
+@app.get("/api/hedge/stats")
+def hedge_stats_endpoint(response: Response):
+    _worker_header(response)
+    return {"enabled": HEDGE_ENABLED, "evaluate": evaluate_hedge_policy.stats()}
+
+@app.get("/api/scheduler/stats")
+def scheduler_stats_endpoint(response: Response):
+    _worker_header(response)
+    return scheduler_stats()
+
+@app.get("/api/upstream/stats")
+def upstream_stats_endpoint(response: Response):
+    _worker_header(response)
+    return {"breakers": breaker_states()}
+
+@app.get("/api/personas")
+def list_personas():
+    return {"personas": [p.to_dict() for p in persona_registry.all()]}
+
 @app.post("/api/evaluate")
 async def evaluate_endpoint(
     openRouterKey: Optional[str] = Form(None),
-    persona: str = Form(...), # JSON string of persona
-    image: UploadFile = File(...),
+    personaId: Optional[str] = Form(None), # id of a built-in persona
+    persona: Optional[str] = Form(None), # or a JSON custom persona ({"name", "bio", "isCustom": true})
+    image: UploadFile = File(None),
+    imageId: Optional[str] = Form(None), # id of a stored image, instead of an upload
+    sessionId: Optional[str] = Form(None), # judge the session's current image instead
 ):
+    if personaId is not None:
+        reference = personaId
+    elif persona is not None:
+        try:
+            reference = json.loads(persona)
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid persona JSON: {e}")
+    else:
+        raise HTTPException(status_code=400, detail="Provide personaId or persona")
+    (resolved,) = _resolve_personas([reference])
+
+    prepared, round_ref = await _request_image(image, imageId, sessionId)
     try:
-        persona_dict = json.loads(persona)
-        # Read image content to send to LLM (base64 encoding will affect this, handle in utils)
-        image_bytes = await image.read()
-        
-        result = await evaluate_image_with_persona(image_bytes, persona_dict, openRouterKey)
+        result = await evaluate_image_with_persona(
+            prepared, resolved, openRouterKey, client=_http_client(), hedge=True
+        )
+        await _update_round(round_ref, lambda r: r.record_verdict(result, resolved.prompt_hash))
         return result
+    except UpstreamError as e:
+        # A verdict from an earlier attempt no longer reflects this judge
+        await _update_round(round_ref, lambda r: r.drop_verdict(resolved.id))
+        raise _upstream_http_error(e)
     except Exception as e:
+        await _update_round(round_ref, lambda r: r.drop_verdict(resolved.id))
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _prepare(source, keep_normalized=False):
+    try:
+        with timed(IMAGE_ENCODE_SECONDS, endpoint_label()):
+            return await prepare_image_async(source, keep_normalized)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+
+async def _read_image(upload):
+    """
+    Size-check an upload and normalize it once (orientation, size, format) off the
+    event loop, decoding straight from the spooled upload file.
+    """
+    source = await spool_upload(upload)
+    return await _prepare(source)
+
+
+async def _load_image(upload, image_id, required=True):
+    """
+    Prepare the image for a request from either a stored image id or an upload.
+    """
+    if image_id:
+        try:
+            image_bytes = await blob_store.read(image_id)
+        except BlobNotFound as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        # Stored uploads are already normalized; reuse them as-is so every
+        # worker sees the same bytes (and evaluation cache keys)
+        return await _prepare(image_bytes, keep_normalized=True)
+    if upload is None:
+        if required:
+            raise HTTPException(status_code=400, detail="Provide an image upload or an imageId")
+        return None
+    return await _read_image(upload)
+
+
+async def _get_session(session_id):
+    try:
+        return await session_store.get(session_id)
+    except SessionNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+async def _update_round(round_ref, fn):
+    """
+    Apply `fn(round)` to the (session id, round number) a request started on;
+    a no-op for requests without a session.
+    """
+    if round_ref is None:
+        return
+    try:
+        await session_store.update_round(*round_ref, fn)
+    except SessionNotFound as e:
+        logger.warning(f"[SESSIONS] Dropping result: {e}")
+
+
+async def _store_image(upload, image_id):
+    """
+    Resolve an upload or stored image id to (blob id, prepared image), storing
+    uploads so later rounds can refer to them by id.
+    """
+    prepared = await _load_image(upload, image_id)
+    if not image_id:
+        image_id = await blob_store.put(prepared.data, prepared.mime_type)
+    return image_id, prepared
+
+
+async def _stored_image(image_id):
+    prepared = prepared_images.get(image_id)
+    if prepared is None:
+        prepared = await _load_image(None, image_id)
+        prepared_images.set(image_id, prepared)
+    return prepared
+
+
+async def _session_image(session):
+    return await _stored_image(session.current.image_id)
+
+
+async def _request_image(upload, image_id, session_id):
+    """
+    Image for an evaluation request plus the (session id, round number) to
+    record verdicts in, or None without a session. The round is captured up
+    front so verdicts still land in it if the session moves on mid-request.
+    """
+    if not session_id:
+        return await _load_image(upload, image_id), None
+    if upload is not None or image_id:
+        raise HTTPException(status_code=400, detail="Send either a sessionId or an image, not both")
+    session = await _get_session(session_id)
+    return await _session_image(session), (session.id, session.current.number)
+
+
+def _image_storer(request):
+    """
+    Build the callback that moves generated images into the blob store and
+    returns the URL clients should use instead of the inline data URI.
+    """
+    base_url = (PUBLIC_BASE_URL or str(request.base_url)).rstrip("/")
+
+    async def store(url):
+        blob_id = await blob_store.put_data_uri(url)
+        if blob_id is None:
+            return url
+        return f"{base_url}/api/blobs/{blob_id}"
+
+    return store
+
+
+def _resolve_personas(items):
+    """
+    Turn persona references (built-in ids, or custom persona dicts) into
+    compiled personas from the registry.
+    """
+    try:
+        return persona_registry.resolve_all(items)
+    except InvalidPersona as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _swipe_stats(results):
+    """
+    Aggregate swipe counts in the shape the frontend uses for a round.
+    """
+    yes = sum(1 for r in results if r.get("swipe") == "right")
+    return {"yes": yes, "total": len(results)}
+
+
+def _parse_persona_list(personas):
+    """
+    Parse the `personas` form field into resolved personas.
+    """
+    try:
+        persona_list = json.loads(personas)
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid personas JSON: {e}")
+    if not isinstance(persona_list, list) or not persona_list:
+        raise HTTPException(status_code=400, detail="personas must be a non-empty JSON list")
+    return _resolve_personas(persona_list)
+
+
+def _parse_mode(mode):
+    mode = mode or DEFAULT_EVALUATION_MODE
+    if mode not in EVALUATION_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(EVALUATION_MODES)}")
+    return mode
+
+
+async def _evaluate_panel(prepared, panel, api_key, concurrency=None, mode="per_persona", hedge=False):
+    """
+    Evaluate one prepared image against every persona concurrently.
+    Yields (index, persona, result_or_exception) in completion order.
+    `hedge` enables straggler hedging for per-persona calls (interactive use).
+
+    In "single_call" mode the whole panel is judged in one vision call first and
+    only personas missing or malformed in that response are evaluated individually.
+    If the panel call itself fails for any other reason, every persona gets its error.
+    """
+    remaining = list(enumerate(panel))
+    if mode == "single_call":
+        try:
+            verdicts = await evaluate_image_with_panel(prepared, panel, api_key, client=_http_client())
+        except UpstreamBadResponse as e:
+            logger.error(f"[EVALUATE_PANEL] Unusable panel response, falling back to per-persona calls: {e}")
+            verdicts = [None] * len(panel)
+        except Exception as e:
+            # Rejected, throttled or failing key: N more calls would fail the same way
+            logger.error(f"[EVALUATE_PANEL] Panel call failed: {e}")
+            for index, persona in remaining:
+                yield index, persona, e
+            return
+        remaining = []
+        for index, (persona, verdict) in enumerate(zip(panel, verdicts)):
+            if verdict is None:
+                remaining.append((index, persona))
+            else:
+                yield index, persona, verdict
+
+    limit = max(1, min(concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY))
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(index, persona):
+        async with semaphore:
+            try:
+                result = await evaluate_image_with_persona(
+                    prepared, persona, api_key, client=_http_client(), hedge=hedge
+                )
+            except Exception as e:
+                return index, persona, e
+            return index, persona, result
+
+    tasks = [asyncio.create_task(run(i, p)) for i, p in remaining]
+    try:
+        for future in asyncio.as_completed(tasks):
+            yield await future
+    finally:
+        # Stop outstanding calls if the consumer (e.g. a disconnected stream) bails out
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+def _persona_error(persona, error):
+    status = error.status_code if isinstance(error, UpstreamError) else 500
+    payload = {"personaId": persona.id, "status": status, "detail": str(error)}
+    if isinstance(error, QueueFullError):
+        payload["queuePosition"] = error.queue_position
+    return payload
+
+
+async def _round_image_hash(session_id, round_, prepared=None):
+    """
+    Perceptual hash of a round's image, computed once and saved on the round.
+    """
+    if round_.image_hash:
+        return round_.image_hash
+    if prepared is None:
+        try:
+            prepared = await _stored_image(round_.image_id)
+        except HTTPException:
+            return None
+    image_hash = await perceptual_hash_async(prepared)
+    if image_hash:
+        await _update_round((session_id, round_.number), lambda r: setattr(r, "image_hash", image_hash))
+    return image_hash
+
+
+async def _incremental_plan(prepared, round_ref, panel):
+    """
+    Compare the round's image with the previous round's and decide which of
+    that round's verdicts carry over (see incremental.plan_reevaluation).
+    """
+    session_id, number = round_ref
+    session = await _get_session(session_id)
+    current, previous = session.round(number), session.round(number - 1)
+    distance = None
+    if previous is not None and previous.verdicts:
+        image_hash = await _round_image_hash(session_id, current, prepared)
+        previous_hash = await _round_image_hash(session_id, previous)
+        if image_hash and previous_hash:
+            distance = hash_distance(image_hash, previous_hash)
+    plan = plan_reevaluation(panel, previous, distance)
+    logger.info(
+        f"[INCREMENTAL] Round {number}: carrying {len(plan.carried)}, re-running {len(plan.fresh)}",
+        extra={"session_id": session_id, "distance": distance},
+    )
+    return plan
+
+
+def _parse_incremental(incremental, session_id):
+    """
+    Incremental evaluation builds on the previous round, so it needs a session;
+    the INCREMENTAL_EVALUATION default only applies to session requests.
+    """
+    if incremental is None:
+        return INCREMENTAL_EVALUATION and bool(session_id)
+    if incremental and not session_id:
+        raise HTTPException(status_code=400, detail="incremental evaluation needs a sessionId")
+    return incremental
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/api/evaluate/batch")
+async def evaluate_batch_endpoint(
+    openRouterKey: Optional[str] = Form(None),
+    personas: str = Form(...), # JSON list of persona ids and/or custom persona dicts
+    concurrency: Optional[int] = Form(None),
+    mode: Optional[str] = Form(None), # "per_persona" or "single_call"
+    image: UploadFile = File(None),
+    imageId: Optional[str] = Form(None), # id of a stored image, instead of an upload
+    sessionId: Optional[str] = Form(None), # judge the session's current image instead
+    incremental: Optional[bool] = Form(None), # reuse the previous round's verdicts where they still hold
+):
+    panel = _parse_persona_list(personas)
+    mode = _parse_mode(mode)
+    incremental = _parse_incremental(incremental, sessionId)
+
+    prepared, round_ref = await _request_image(image, imageId, sessionId)
+
+    outcomes = [None] * len(panel)
+    plan = await _incremental_plan(prepared, round_ref, panel) if incremental else None
+    fresh = plan.fresh if plan else list(range(len(panel)))
+    if plan:
+        for index, verdict in plan.carried.items():
+            outcomes[index] = (panel[index], verdict)
+    try:
+        async for index, persona, outcome in _evaluate_panel(
+            prepared, [panel[i] for i in fresh], openRouterKey, concurrency, mode
+        ):
+            if plan and not isinstance(outcome, Exception):
+                outcome = {**outcome, "carriedOver": False}
+            outcomes[fresh[index]] = (persona, outcome)
+    except UpstreamError as e:
+        raise _upstream_http_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # Keep the response in the order personas were requested
+    results = []
+    errors = []
+    first_failure = None
+    for persona, outcome in outcomes:
+        if isinstance(outcome, Exception):
+            errors.append(_persona_error(persona, outcome))
+            first_failure = first_failure or outcome
+        else:
+            results.append(outcome)
+
+    def record(round_):
+        # This panel replaces earlier ones: judges left out or failing no longer count
+        round_.clear_verdicts()
+        for persona, outcome in outcomes:
+            if not isinstance(outcome, Exception):
+                round_.record_verdict(outcome, persona.prompt_hash)
+
+    await _update_round(round_ref, record)
+
+    if not results and first_failure is not None:
+        if isinstance(first_failure, UpstreamError):
+            raise _upstream_http_error(first_failure)
+        raise HTTPException(status_code=502, detail=str(first_failure))
+
+    response = {"results": results, "errors": errors, "swipeStats": _swipe_stats(results), "mode": mode}
+    if plan:
+        response["incremental"] = plan.to_dict()
+    return response
+
+@app.post("/api/evaluate/stream")
+async def evaluate_stream_endpoint(
+    openRouterKey: Optional[str] = Form(None),
+    personas: str = Form(...), # JSON list of persona ids and/or custom persona dicts
+    concurrency: Optional[int] = Form(None),
+    mode: Optional[str] = Form(None), # "per_persona" or "single_call"
+    image: UploadFile = File(None),
+    imageId: Optional[str] = Form(None), # id of a stored image, instead of an upload
+    sessionId: Optional[str] = Form(None), # judge the session's current image instead
+    incremental: Optional[bool] = Form(None), # reuse the previous round's verdicts where they still hold
+):
+    """
+    Server-Sent Events variant of the batch endpoint: one `verdict` (or `error`) event
+    per persona as soon as it finishes, then a final `summary` event. In incremental
+    mode the carried-over verdicts are sent first.
+    """
+    panel = _parse_persona_list(personas)
+    mode = _parse_mode(mode)
+    incremental = _parse_incremental(incremental, sessionId)
+    # Read before streaming starts; the upload is closed once the handler returns
+    prepared, round_ref = await _request_image(image, imageId, sessionId)
+    plan = await _incremental_plan(prepared, round_ref, panel) if incremental else None
+    fresh = plan.fresh if plan else list(range(len(panel)))
+
+    async def events():
+        results = []
+        errors = []
+        def record(round_):
+            # This panel replaces earlier ones: judges left out or failing no longer count
+            round_.clear_verdicts()
+            for index, verdict in (plan.carried.items() if plan else ()):
+                round_.record_verdict(verdict, panel[index].prompt_hash)
+
+        await _update_round(round_ref, record)
+        if plan and plan.carried:
+            for _, verdict in sorted(plan.carried.items()):
+                results.append(verdict)
+                yield _sse("verdict", {"result": verdict, "swipeStats": _swipe_stats(results)})
+        async for _, persona, outcome in _evaluate_panel(
+            prepared, [panel[i] for i in fresh], openRouterKey, concurrency, mode, hedge=True
+        ):
+            if isinstance(outcome, Exception):
+                error = _persona_error(persona, outcome)
+                errors.append(error)
+                yield _sse("error", error)
+            else:
+                if plan:
+                    outcome = {**outcome, "carriedOver": False}
+                results.append(outcome)
+                await _update_round(round_ref, lambda r: r.record_verdict(outcome, persona.prompt_hash))
+                yield _sse("verdict", {"result": outcome, "swipeStats": _swipe_stats(results)})
+        summary = {"results": results, "errors": errors, "swipeStats": _swipe_stats(results), "mode": mode}
+        if plan:
+            summary["incremental"] = plan.to_dict()
+        yield _sse("summary", summary)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.post("/api/combine")
 async def combine_endpoint(request: CombineRequest):
+    round_ref = None
+    goal = request.goal
+    feedbacks = request.feedbacks
+    if request.sessionId:
+        session = await _get_session(request.sessionId)
+        round_ref = (session.id, session.current.number)
+        goal = goal or session.goal
+        if feedbacks is None:
+            feedbacks = session.current.feedbacks()
+    if not feedbacks:
+        raise HTTPException(status_code=400, detail="No feedbacks to combine")
     try:
-        result = await combine_feedback(request.feedbacks, request.openRouterKey, request.goal)
+        result = await combine_feedback(
+            feedbacks, request.openRouterKey, goal or "right", client=_http_client()
+        )
+        await _update_round(round_ref, lambda r: setattr(r, "suggestions", result))
         return result
+    except UpstreamError as e:
+        raise _upstream_http_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _generation_args(openRouterKey, count, suggestions, originalImage, originalImageId, sessionId):
+    """
+    Resolve generation inputs. With a session, the current round's image and
+    combined prompt are used unless given explicitly.
+    """
+    # Limit photo generation to 2 max when using default API key
+    if openRouterKey is None:
+        count = min(count, 2)
+    count = max(1, min(count, GENERATE_MAX_COUNT))
+    
+    round_ref = None
+    original_image = None
+    if sessionId:
+        session = await _get_session(sessionId)
+        round_ref = (session.id, session.current.number)
+        if not suggestions and session.current.suggestions:
+            suggestions = session.current.suggestions.get("prompt")
+        if originalImage is None and not originalImageId:
+            original_image = await _session_image(session)
+    if not suggestions:
+        raise HTTPException(status_code=400, detail="suggestions are required (or combine the session's feedback first)")
+
+    # Read original image if provided
+    if original_image is None:
+        original_image = await _load_image(originalImage, originalImageId, required=False)
+    return count, suggestions, original_image, round_ref
+
 @app.post("/api/generate")
 async def generate_endpoint(
+    request: Request,
     openRouterKey: Optional[str] = Form(None),
-    suggestions: str = Form(...),
+    suggestions: Optional[str] = Form(None),
     count: int = Form(4),
-    originalImage: UploadFile = File(None)
+    originalImage: UploadFile = File(None),
+    originalImageId: Optional[str] = Form(None), # id of a stored image, instead of an upload
+    sessionId: Optional[str] = Form(None), # defaults suggestions and image from the session
 ):
+    count, suggestions, original_image, round_ref = await _generation_args(
+        openRouterKey, count, suggestions, originalImage, originalImageId, sessionId
+    )
     try:
-        # Limit photo generation to 2 max when using default API key
-        if openRouterKey is None:
-            count = min(count, 2)
-        
-        # Read original image if provided
-        original_image_bytes = None
-        if originalImage:
-            original_image_bytes = await originalImage.read()
-        
         # returns list of image urls
         images = await generate_new_images(
             suggestions, 
             openRouterKey, 
             count=count,
-            original_image=original_image_bytes
+            original_image=original_image,
+            client=_http_client(),
+            store_image=_image_storer(request),
         )
+        await _update_round(round_ref, lambda r: r.generated.extend(images))
         return {"images": images}
+    except UpstreamError as e:
+        raise _upstream_http_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/generate/jobs", status_code=202)
+async def submit_generate_job_endpoint(
+    request: Request,
+    openRouterKey: Optional[str] = Form(None),
+    suggestions: Optional[str] = Form(None),
+    count: int = Form(4),
+    originalImage: UploadFile = File(None),
+    originalImageId: Optional[str] = Form(None), # id of a stored image, instead of an upload
+    sessionId: Optional[str] = Form(None), # defaults suggestions and image from the session
+):
+    """
+    Queue an image generation and return its job id immediately. Poll
+    GET /api/generate/jobs/{id} or subscribe to .../events for progress.
+    """
+    count, suggestions, original_image, round_ref = await _generation_args(
+        openRouterKey, count, suggestions, originalImage, originalImageId, sessionId
+    )
+    store_image = _image_storer(request)
+
+    async def run(job):
+        async def on_image(url):
+            await job.publish("progress", {"image": url})
+        images = await generate_new_images(
+            suggestions,
+            openRouterKey,
+            count=count,
+            original_image=original_image,
+            client=_http_client(),
+            on_image=on_image,
+            store_image=store_image,
+        )
+        await _update_round(round_ref, lambda r: r.generated.extend(images))
+        return {"images": images}
+
+    try:
+        job = await job_manager.submit(run)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    return JSONResponse(status_code=202, content={"jobId": job.id, "status": job.status})
+
+async def _get_job(job_id):
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+@app.get("/api/generate/jobs/{job_id}")
+async def generate_job_status_endpoint(job_id: str):
+    return await _get_job(job_id)
+
+@app.get("/api/generate/jobs/{job_id}/events")
+async def generate_job_events_endpoint(job_id: str):
+    """
+    Server-Sent Events: a `snapshot` of the job, then `status`/`progress`
+    events, ending with a `done` or `failed` event carrying the final job.
+    """
+    await _get_job(job_id)
+
+    async def events():
+        async for event, data in job_manager.watch(job_id):
+            yield _sse(event, data)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/api/sessions", status_code=201)
+async def create_session_endpoint(
+    goal: str = Form("right"),
+    image: UploadFile = File(None),
+    imageId: Optional[str] = Form(None), # id of a stored image, instead of an upload
+):
+    """
+    Start a session from an image. Later evaluate/combine/generate calls pass
+    the returned sessionId instead of re-sending the image and feedback.
+    """
+    image_id, prepared = await _store_image(image, imageId)
+    session = await session_store.create(image_id, goal)
+    prepared_images.set(image_id, prepared)
+    return session.to_dict()
+
+@app.get("/api/sessions/{session_id}")
+async def get_session_endpoint(session_id: str):
+    return (await _get_session(session_id)).to_dict()
+
+@app.post("/api/sessions/{session_id}/rounds")
+async def start_round_endpoint(
+    session_id: str,
+    image: UploadFile = File(None),
+    imageId: Optional[str] = Form(None), # e.g. the blob id of a picked generated image
+):
+    """
+    Continue the session with a new image; the current round moves to history.
+    """
+    await _get_session(session_id)
+    image_id, prepared = await _store_image(image, imageId)
+    try:
+        session = await session_store.update(session_id, lambda s: s.start_round(image_id))
+    except SessionNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    prepared_images.set(image_id, prepared)
+    return session.to_dict()
+
+@app.delete("/api/sessions/{session_id}", status_code=204)
+async def delete_session_endpoint(session_id: str):
+    await session_store.delete(session_id)
+    return Response(status_code=204)
+
+@app.get("/api/blobs/{blob_id}")
+def blob_endpoint(blob_id: str, request: Request):
+    """
+    Stream a stored image. Ids are content hashes, so responses never change
+    and can be cached indefinitely.
+    """
+    try:
+        path = blob_store.path(blob_id)
+    except BlobNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    etag = f'"{blob_id}"'
+    headers = {"Cache-Control": "public, max-age=31536000, immutable", "ETag": etag}
+    if request.headers.get("if-none-match") == etag and blob_store.exists(blob_id):
+        return Response(status_code=304, headers=headers)
+    if not blob_store.exists(blob_id):
+        raise HTTPException(status_code=404, detail=f"Image not found: {blob_id}")
+    return FileResponse(path, media_type=mime_type_for(blob_id), headers=headers)
+
+def _prepare_metrics_dir():
+    """
+    Point every worker at one empty PROMETHEUS_MULTIPROC_DIR before they start
+    (the workers inherit the environment). Returns a directory to remove on exit.
+    """
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        # Files from an earlier run would be summed into this one
+        for name in os.listdir(path):
+            if name.endswith(".db"):
+                os.remove(os.path.join(path, name))
+        return None
+    path = tempfile.mkdtemp(prefix="judge-metrics-")
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+    return path
+
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    metrics_dir = _prepare_metrics_dir() if WEB_CONCURRENCY > 1 else None
+    # An import string lets uvicorn spawn WEB_CONCURRENCY worker processes
+    try:
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=8000,
+            workers=WEB_CONCURRENCY,
+            timeout_graceful_shutdown=SHUTDOWN_GRACE_PERIOD,
+        )
+    finally:
+        if metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
@@ -0,0 +1,156 @@
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+
+# With several workers, each records into files under this directory and /metrics
+# sums them; `python main.py` sets it when WEB_CONCURRENCY > 1
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR", "")
+
+# Request scope of the call being served, set by MetricsMiddleware; used to label by endpoint
+_current_scope = contextvars.ContextVar("metrics_scope", default=None)
+
+_FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+_SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+REQUEST_SECONDS = Histogram(
+    "judge_request_seconds", "Total request time", ["endpoint", "method", "status"], buckets=_SLOW_BUCKETS
+)
+UPLOAD_READ_SECONDS = Histogram(
+    "judge_upload_read_seconds", "Time to receive a multipart request body", ["endpoint"], buckets=_FAST_BUCKETS
+)
+IMAGE_ENCODE_SECONDS = Histogram(
+    "judge_image_encode_seconds", "Time to normalize and base64-encode an image", ["endpoint"], buckets=_FAST_BUCKETS
+)
+UPSTREAM_SECONDS = Histogram(
+    "judge_upstream_seconds", "OpenRouter call latency per attempt", ["model", "endpoint"], buckets=_SLOW_BUCKETS
+)
+UPSTREAM_RESPONSES = Counter(
+    "judge_upstream_responses_total", "OpenRouter responses by status code", ["model", "endpoint", "status"]
+)
+IMAGE_DECODE_BYTES = Histogram(
+    "judge_image_decode_bytes",
+    "Size of the decoded bitmap per image, the bulk of per-request memory",
+    ["endpoint"],
+    buckets=tuple(mb * 1024 * 1024 for mb in (1, 2, 4, 8, 16, 32, 64, 128)),
+)
+JSON_PARSE_SECONDS = Histogram(
+    "judge_json_parse_seconds", "Time to parse model JSON output", ["stage", "endpoint"], buckets=_FAST_BUCKETS
+)
+JSON_PARSE_FALLBACKS = Counter(
+    "judge_json_parse_fallbacks_total", "Model outputs that failed to parse as JSON", ["stage", "persona", "endpoint"]
+)
+CACHE_LOOKUPS = Counter(
+    "judge_cache_lookups_total", "Evaluation cache lookups", ["result", "persona", "endpoint"]
+)
+GENERATED_IMAGES = Counter(
+    "judge_generated_images_total", "Images returned by the generation model", ["endpoint"]
+)
+INCREMENTAL_VERDICTS = Counter(
+    "judge_incremental_verdicts_total", "Verdicts in incremental evaluations by re-run decision", ["decision", "endpoint"]
+)
+
+
+def endpoint_label():
+    """
+    Route template of the request being served (bounded cardinality), or "none"
+    outside a request.
+    """
+    scope = _current_scope.get()
+    if scope is None:
+        return "none"
+    route = scope.get("route")
+    return getattr(route, "path", "other")
+
+
+def persona_label(persona):
+    """
+    Built-in personas are labeled by id; client-defined ones share one label.
+    """
+    if persona is None:
+        return "none"
+    if not persona.is_custom:
+        return str(persona.id)
+    return "custom"
+
+
+@contextmanager
+def timed(histogram, *labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(*labels).observe(time.perf_counter() - start)
+
+
+def render_metrics():
+    """
+    Exposition for every worker process in multiprocess mode, else for this one.
+    """
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording total request time and exposing the request scope
+    to endpoint_label() for metrics recorded deeper in the call stack.
+    For multipart requests it also times the body from the first chunk the form
+    parser asks for to the last one, which is when the upload is fully spooled.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        if _is_multipart(scope):
+            receive = self._timed_receive(receive)
+
+        token = _current_scope.set(scope)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Streaming responses are included up to their last chunk
+            REQUEST_SECONDS.labels(endpoint_label(), scope["method"], str(status["code"])).observe(
+                time.perf_counter() - start
+            )
+            _current_scope.reset(token)
+
+    @staticmethod
+    def _timed_receive(receive):
+        started = None
+
+        async def timed_receive():
+            nonlocal started
+            if started is None:
+                started = time.perf_counter()
+            message = await receive()
+            if message["type"] == "http.request" and not message.get("more_body", False):
+                UPLOAD_READ_SECONDS.labels(endpoint_label()).observe(time.perf_counter() - started)
+            return message
+
+        return timed_receive
+
+
+def _is_multipart(scope):
+    for name, value in scope["headers"]:
+        if name == b"content-type":
+            return value.startswith(b"multipart/form-data")
+    return False
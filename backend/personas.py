@@ -0,0 +1,225 @@
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+# Persona definitions shared with the frontend, loaded once at startup. The default
+# points into the frontend tree; deployments without it must set this explicitly
+PERSONAS_PATH = os.environ.get(
+    "PERSONAS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "frontend", "src", "data", "personas.json"),
+)
+# Accept client-defined judges (name + bio) alongside the built-in ones
+ALLOW_CUSTOM_PERSONAS = os.environ.get("ALLOW_CUSTOM_PERSONAS", "1") == "1"
+CUSTOM_PERSONA_MAX_NAME = int(os.environ.get("CUSTOM_PERSONA_MAX_NAME", "80"))
+CUSTOM_PERSONA_MAX_BIO = int(os.environ.get("CUSTOM_PERSONA_MAX_BIO", "1000"))
+
+# Bump whenever the templates below change: it is part of every prompt hash,
+# so cached verdicts from older prompts stop matching
+PERSONA_PROMPT_VERSION = "1"
+
+# Shared by the per-persona and single-call panel prompts
+EVALUATION_CRITERIA = """1. **First Impression** (0-3 seconds): What emotion does this photo trigger immediately?
+    2. **Face & Expression**: Is the face clearly visible? Genuine smile vs forced? Eye contact?
+    3. **Body Language**: Confident? Approachable? Awkward? Open or closed posture?
+    4. **Setting/Background**: Interesting? Distracting? Does it tell a story about lifestyle?
+    5. **Photo Quality**: Lighting quality, resolution, angles, selfie vs someone else took it
+    6. **Outfit & Grooming**: Effort level, style match, cleanliness, appropriateness
+    7. **Authenticity**: Does it feel staged/try-hard or natural/effortless?
+    8. **Red Flags**: Group photos, bathroom selfies, exes cropped out, sunglasses hiding face, etc."""
+
+VERDICT_FIELDS = """        "swipe": "left" or "right",
+        "first_impression": "One sentence - your gut reaction in the first 3 seconds",
+        "reason": "2-3 sentences explaining WHY you swiped this way, from your character's perspective",
+        "likes": "Be SPECIFIC - not 'nice smile' but 'the genuine laugh lines around the eyes show authenticity'",
+        "dislikes": "Be SPECIFIC - not 'bad lighting' but 'harsh overhead lighting creates unflattering shadows under the eyes'",
+        "keep": "The ONE element that works best and should absolutely stay",
+        "change": "The ONE change that would have the biggest positive impact on your decision",
+        "scores": {
+            "attractiveness": 1-10,
+            "authenticity": 1-10,
+            "photo_quality": 1-10,
+            "overall_swipeability": 1-10
+        }"""
+
+
+def render_evaluation_prompt(name, bio):
+    """
+    System prompt for judging an image as one persona.
+    """
+    return f"""
+    You are `{name}` with this personality: `{bio}`.
+    You must think and respond as this specific person would - with their unique preferences, dealbreakers, and taste.
+
+    ## EVALUATION CRITERIA
+    Analyze these specific aspects of the Tinder profile picture:
+
+    {EVALUATION_CRITERIA}
+
+    ## YOUR TASK
+    Based on YOUR CHARACTER's specific preferences and personality, decide: Would YOU swipe RIGHT or LEFT?
+
+    Remember:
+    - What would SPECIFICALLY attract YOUR character type?
+    - What are YOUR dealbreakers based on your personality?
+    - Don't give generic advice - filter everything through YOUR unique perspective.
+
+    ## OUTPUT FORMAT
+    Respond with ONLY this JSON object:
+    {{
+{VERDICT_FIELDS}
+    }}
+    """
+
+
+class InvalidPersona(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class Persona:
+    """
+    A judge with its prompts rendered once. `prompt_hash` identifies the exact
+    prompt text (and template version), so it can stand in for the persona in
+    cache keys.
+    """
+    id: object
+    name: str
+    bio: str
+    gender: str = ""
+    avatar: str = ""
+    is_custom: bool = False
+    system_prompt: str = field(init=False, repr=False)
+    panel_text: str = field(init=False, repr=False)
+    prompt_hash: str = field(init=False)
+
+    def __post_init__(self):
+        system_prompt = render_evaluation_prompt(self.name, self.bio)
+        material = json.dumps([PERSONA_PROMPT_VERSION, system_prompt], ensure_ascii=False)
+        object.__setattr__(self, "system_prompt", system_prompt)
+        object.__setattr__(self, "panel_text", f"`{self.name}` with this personality: `{self.bio}`")
+        object.__setattr__(self, "prompt_hash", hashlib.sha256(material.encode("utf-8")).hexdigest())
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "gender": self.gender,
+            "bio": self.bio,
+            "avatar": self.avatar,
+            "isCustom": self.is_custom,
+            "promptHash": self.prompt_hash,
+        }
+
+
+def custom_persona(data):
+    """
+    Build a client-defined persona from its name and bio, the only fields that
+    reach the prompt. Raises InvalidPersona when custom judges are disabled or
+    the fields are missing or too long.
+    """
+    if not ALLOW_CUSTOM_PERSONAS:
+        raise InvalidPersona("Custom personas are disabled; reference personas by id")
+    name, bio = data.get("name"), data.get("bio")
+    if not isinstance(name, str) or not name.strip() or not isinstance(bio, str) or not bio.strip():
+        raise InvalidPersona("Custom personas need a non-empty name and bio")
+    if len(name) > CUSTOM_PERSONA_MAX_NAME or len(bio) > CUSTOM_PERSONA_MAX_BIO:
+        raise InvalidPersona(
+            f"Custom persona name/bio are limited to {CUSTOM_PERSONA_MAX_NAME}/{CUSTOM_PERSONA_MAX_BIO} characters"
+        )
+    persona_id = data.get("id")
+    if not isinstance(persona_id, (str, int)) or isinstance(persona_id, bool):
+        persona_id = "custom"
+    return Persona(
+        id=persona_id,
+        name=name.strip(),
+        bio=bio.strip(),
+        gender=data.get("gender") if isinstance(data.get("gender"), str) else "",
+        is_custom=True,
+    )
+
+
+class PersonaRegistry:
+    """
+    The built-in personas keyed by id, compiled once and read-only afterwards.
+    """
+
+    def __init__(self, personas):
+        self._personas = MappingProxyType({p.id: p for p in personas})
+
+    @classmethod
+    def load(cls, path=PERSONAS_PATH):
+        """
+        Load the built-in personas. A missing or malformed file leaves the
+        registry empty; the app refuses to start on an empty registry.
+        """
+        try:
+            with open(path, encoding="utf-8") as f:
+                entries = json.load(f)
+            personas = [
+                Persona(
+                    id=entry["id"],
+                    name=entry["name"],
+                    bio=entry["bio"],
+                    gender=entry.get("gender", ""),
+                    avatar=entry.get("avatar", ""),
+                )
+                for entry in entries
+            ]
+        except (OSError, json.JSONDecodeError, KeyError, TypeError, AttributeError) as e:
+            logger.error(f"[PERSONAS] Could not load personas from {path}: {e!r}")
+            return cls([])
+        logger.info(f"[PERSONAS] Loaded {len(personas)} personas (prompt version {PERSONA_PROMPT_VERSION})")
+        return cls(personas)
+
+    def __len__(self):
+        return len(self._personas)
+
+    def all(self):
+        return list(self._personas.values())
+
+    def get(self, persona_id):
+        """
+        Look up a built-in persona. Ids arriving as strings from form fields
+        are matched against integer ids too.
+        """
+        persona = self._personas.get(persona_id)
+        if persona is None and isinstance(persona_id, str) and persona_id.isdigit():
+            persona = self._personas.get(int(persona_id))
+        if persona is None:
+            raise InvalidPersona(f"Unknown persona id: {persona_id}")
+        return persona
+
+    def resolve(self, item):
+        """
+        Turn a request item into a Persona: a built-in id, or a dict. Dicts
+        naming a built-in persona resolve to it and their text is ignored;
+        only dicts marked `isCustom` are compiled from the client's fields.
+        """
+        if isinstance(item, Persona):
+            return item
+        if isinstance(item, dict):
+            if item.get("isCustom"):
+                return custom_persona(item)
+            item = item.get("id")
+        if isinstance(item, bool) or not isinstance(item, (str, int)):
+            raise InvalidPersona(f"Invalid persona reference: {item!r}")
+        return self.get(item)
+
+    def resolve_all(self, items):
+        return [self.resolve(item) for item in items]
+
+
+def as_persona(persona):
+    """
+    Accept a Persona or a plain dict (resolved through the registry).
+    """
+    return persona_registry.resolve(persona)
+
+
+# Process-wide registry
+persona_registry = PersonaRegistry.load()
@@ -0,0 +1,323 @@
+import asyncio
+import contextvars
+import hashlib
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from state import WEB_CONCURRENCY, shared_state
+
+logger = logging.getLogger(__name__)
+
+# Limits for the shared OPENROUTER_API_KEY that anonymous users fall back to
+RATE_LIMIT_DEFAULT_RPS = float(os.environ.get("RATE_LIMIT_DEFAULT_RPS", "2"))
+RATE_LIMIT_DEFAULT_BURST = float(os.environ.get("RATE_LIMIT_DEFAULT_BURST", "10"))
+RATE_LIMIT_DEFAULT_MAX_IN_FLIGHT = int(os.environ.get("RATE_LIMIT_DEFAULT_MAX_IN_FLIGHT", "16"))
+# Limits for keys supplied by users
+RATE_LIMIT_USER_RPS = float(os.environ.get("RATE_LIMIT_USER_RPS", "10"))
+RATE_LIMIT_USER_BURST = float(os.environ.get("RATE_LIMIT_USER_BURST", "20"))
+RATE_LIMIT_USER_MAX_IN_FLIGHT = int(os.environ.get("RATE_LIMIT_USER_MAX_IN_FLIGHT", "32"))
+# Requests waiting beyond this depth (per key) are rejected with 429
+RATE_LIMIT_MAX_QUEUE = int(os.environ.get("RATE_LIMIT_MAX_QUEUE", "64"))
+# Most requests one client may have waiting per key
+RATE_LIMIT_MAX_QUEUE_PER_CLIENT = int(
+    os.environ.get("RATE_LIMIT_MAX_QUEUE_PER_CLIENT", str(max(1, RATE_LIMIT_MAX_QUEUE // 4)))
+)
+# Idle per-key schedulers kept around; the least recently used idle ones beyond this are dropped
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", "1024"))
+# Peer addresses (e.g. the reverse proxy) whose X-Client-Id / X-Forwarded-For headers are believed
+TRUSTED_PROXIES = {ip.strip() for ip in os.environ.get("TRUSTED_PROXIES", "").split(",") if ip.strip()}
+
+# Identity of the client behind the current request, set by ClientIdentityMiddleware
+current_client = contextvars.ContextVar("current_client", default="anonymous")
+
+
+class QueueFull(Exception):
+    """
+    The key's backlog is too deep; `queue_position` is where the call would have been queued.
+    """
+
+    def __init__(self, queue_position, retry_after=None):
+        super().__init__(f"Too many queued requests for this API key (queue position would be {queue_position})")
+        self.queue_position = queue_position
+        self.retry_after = retry_after
+
+
+class KeyScheduler:
+    """
+    Admission control for one API key: a token bucket for request rate, a cap on
+    in-flight requests, and per-client FIFO queues served round-robin so one busy
+    client cannot starve the others.
+
+    With a `bucket` name the rate is enforced across worker processes: tokens are
+    taken from the shared state backend in batches sized to the local backlog
+    instead of refilling locally. Queues and the in-flight cap stay per process.
+    """
+
+    def __init__(self, rate, burst, max_in_flight, max_queue, bucket=None, max_queue_per_client=None):
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client or max_queue
+        self.bucket = bucket
+        self.tokens = 0 if bucket else burst
+        self.updated_at = time.monotonic()
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+        self._queues = OrderedDict()  # client id -> deque of waiting futures
+        self._timer = None
+        self._fetcher = None
+
+    def _refill(self):
+        if self.bucket:
+            return
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def _can_admit(self):
+        self._refill()
+        return self.in_flight < self.max_in_flight and self.tokens >= 1
+
+    def _admit(self):
+        self.tokens -= 1
+        self.in_flight += 1
+
+    def _next_waiter(self):
+        # Rotate through clients: take one waiter from the head client, move it to the back
+        while self._queues:
+            client, waiters = self._queues.popitem(last=False)
+            while waiters and waiters[0].done():
+                waiters.popleft()
+            if not waiters:
+                continue
+            waiter = waiters.popleft()
+            if waiters:
+                self._queues[client] = waiters
+            return waiter
+        return None
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self.queued and self._can_admit():
+            waiter = self._next_waiter()
+            if waiter is None:
+                break
+            self.queued -= 1
+            self._admit()
+            waiter.set_result(None)
+        if self.queued and self.in_flight < self.max_in_flight:
+            if self.bucket:
+                if self._fetcher is None:
+                    self._fetcher = asyncio.create_task(self._fetch_tokens())
+            elif self._timer is None:
+                # Waiting on the token bucket, not on a release: wake up when a token is due
+                wait = max(0.0, (1 - self.tokens) / self.rate) if self.rate > 0 else 1.0
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+
+    async def _fetch_tokens(self):
+        """
+        Take tokens from the shared bucket for the current backlog, waiting out
+        an empty bucket, then dispatch.
+        """
+        try:
+            while self.queued and self.in_flight < self.max_in_flight and self.tokens < 1:
+                want = min(self.queued, self.max_in_flight - self.in_flight)
+                granted, wait = await shared_state.take_tokens(self.bucket, self.rate, self.burst, want)
+                self.tokens = min(self.burst, self.tokens + granted)
+                if not granted:
+                    await asyncio.sleep(wait)
+        except asyncio.CancelledError:
+            self._fetcher = None
+            raise
+        except Exception as e:
+            logger.error(f"[SCHEDULER] Shared rate-limit bucket unavailable: {e}")
+            await asyncio.sleep(1.0)
+        self._fetcher = None
+        self._dispatch()
+
+    def _waiting(self, client):
+        return sum(1 for waiter in self._queues.get(client, ()) if not waiter.done())
+
+    def _queue_full(self, position):
+        self.rejected += 1
+        retry_after = position / self.rate if self.rate > 0 else None
+        return QueueFull(position, retry_after)
+
+    def _make_room(self, client):
+        """
+        The queue is full: push out the newest call of the client with the most
+        waiting, unless that is the caller itself. Returns False if the caller
+        should be rejected instead.
+        """
+        heaviest = max(self._queues, key=self._waiting, default=None)
+        if heaviest is None or self._waiting(heaviest) <= self._waiting(client) + 1:
+            return False
+        waiters = self._queues[heaviest]
+        evicted = False
+        while waiters and not evicted:
+            waiter = waiters.pop()
+            if not waiter.done():
+                waiter.set_exception(self._queue_full(len(waiters) + 1))
+                self.queued -= 1
+                evicted = True
+        if not waiters:
+            del self._queues[heaviest]
+        return evicted
+
+    async def acquire(self, client):
+        if not self.queued and self._can_admit():
+            self._admit()
+            return
+        waiting = self._waiting(client)
+        if waiting >= self.max_queue_per_client:
+            raise self._queue_full(waiting + 1)
+        if self.queued >= self.max_queue and not self._make_room(client):
+            raise self._queue_full(self.queued + 1)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(client, deque()).append(waiter)
+        self.queued += 1
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                if waiter.exception() is None:
+                    # Admitted just as we were cancelled: hand the slot back
+                    self.release()
+                # Otherwise pushed out by _make_room, which already uncounted it
+            else:
+                waiter.cancel()
+                self.queued -= 1
+                self._forget(client, waiter)
+            raise
+
+    def _forget(self, client, waiter):
+        waiters = self._queues.get(client)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(waiter)
+        except ValueError:
+            pass
+        if not waiters:
+            del self._queues[client]
+
+    @property
+    def idle(self):
+        return not self.in_flight and not self.queued
+
+    def release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def stats(self):
+        self._refill()
+        return {
+            "inFlight": self.in_flight,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "tokens": round(self.tokens, 2),
+            "clientsWaiting": len(self._queues),
+            "shared": bool(self.bucket),
+        }
+
+
+_schedulers = OrderedDict()  # key id -> KeyScheduler, least recently used first
+
+
+def _evict_idle_schedulers():
+    excess = len(_schedulers) - RATE_LIMIT_MAX_KEYS
+    if excess <= 0:
+        return
+    for key_id in [key_id for key_id, scheduler in _schedulers.items() if scheduler.idle][:excess]:
+        del _schedulers[key_id]
+
+
+def _scheduler_for(api_key):
+    key_id = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    scheduler = _schedulers.get(key_id)
+    if scheduler is not None:
+        _schedulers.move_to_end(key_id)
+    else:
+        if api_key == os.environ.get("OPENROUTER_API_KEY"):
+            rate, burst, max_in_flight = RATE_LIMIT_DEFAULT_RPS, RATE_LIMIT_DEFAULT_BURST, RATE_LIMIT_DEFAULT_MAX_IN_FLIGHT
+        else:
+            rate, burst, max_in_flight = RATE_LIMIT_USER_RPS, RATE_LIMIT_USER_BURST, RATE_LIMIT_USER_MAX_IN_FLIGHT
+        bucket = None
+        if shared_state.shared:
+            # One rate budget for all workers; each worker gets its share of the in-flight cap
+            bucket = key_id
+            max_in_flight = max(1, math.ceil(max_in_flight / WEB_CONCURRENCY))
+        scheduler = KeyScheduler(
+            rate, burst, max_in_flight, RATE_LIMIT_MAX_QUEUE,
+            bucket=bucket, max_queue_per_client=RATE_LIMIT_MAX_QUEUE_PER_CLIENT,
+        )
+        _schedulers[key_id] = scheduler
+        _evict_idle_schedulers()
+    return scheduler
+
+
+@asynccontextmanager
+async def upstream_slot(api_key):
+    """
+    Hold an admission slot for one upstream request made with `api_key` on
+    behalf of the current client.
+    """
+    scheduler = _scheduler_for(api_key)
+    await scheduler.acquire(current_client.get())
+    try:
+        yield
+    finally:
+        scheduler.release()
+
+
+def scheduler_stats():
+    return {key_id: scheduler.stats() for key_id, scheduler in _schedulers.items()}
+
+
+class ClientIdentityMiddleware:
+    """
+    ASGI middleware that records who is calling so the scheduler can queue fairly.
+    Uses the peer address. When the peer is one of TRUSTED_PROXIES, its
+    X-Client-Id header is used instead, or else the nearest X-Forwarded-For hop
+    that is not itself a trusted proxy. Anyone else could set these headers to
+    a new value per request and get extra round-robin turns.
+    """
+
+    def __init__(self, app, trusted_proxies=None):
+        self.app = app
+        self.trusted_proxies = TRUSTED_PROXIES if trusted_proxies is None else set(trusted_proxies)
+
+    def _identify(self, scope):
+        peer = scope["client"][0] if scope.get("client") else ""
+        if peer not in self.trusted_proxies:
+            return peer
+        headers = dict(scope.get("headers") or [])
+        client = headers.get(b"x-client-id", b"").decode("latin-1").strip()
+        if client:
+            return client
+        hops = [hop.strip() for hop in headers.get(b"x-forwarded-for", b"").decode("latin-1").split(",")]
+        # Hops are appended left to right, so only the right end was written by our proxies
+        for hop in reversed(hops):
+            if hop and hop not in self.trusted_proxies:
+                return hop
+        return peer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = current_client.set(self._identify(scope) or "anonymous")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_client.reset(token)
@@ -0,0 +1,209 @@
+import os
+import time
+import uuid
+
+from cache import MemoryCache
+from state import shared_state
+
+# Server-side state for the evaluate -> combine -> generate -> pick loop
+SESSION_TTL = float(os.environ.get("SESSION_TTL", str(6 * 3600)))
+# Prepared (normalized) session images kept per process, keyed by blob id
+SESSION_IMAGE_CACHE_ENTRIES = int(os.environ.get("SESSION_IMAGE_CACHE_ENTRIES", "64"))
+
+_NAMESPACE = "sessions"
+
+
+class SessionNotFound(Exception):
+    pass
+
+
+class Round:
+    """
+    One iteration of the loop: the image being judged (a blob id), the verdicts
+    keyed by persona id, the combined suggestions and the images generated from them.
+    Each panel evaluation replaces the verdicts, so they always describe the latest one.
+    `image_hash` (perceptual) and `prompt_hashes` let the next round tell which
+    verdicts can carry over.
+    """
+
+    def __init__(self, number, image_id):
+        self.number = number
+        self.image_id = image_id
+        self.image_hash = None
+        self.verdicts = {}
+        self.prompt_hashes = {}
+        self.suggestions = None
+        self.generated = []
+
+    def record_verdict(self, verdict, prompt_hash=None):
+        key = str(verdict.get("personaId"))
+        self.verdicts[key] = verdict
+        if prompt_hash:
+            self.prompt_hashes[key] = prompt_hash
+        else:
+            self.prompt_hashes.pop(key, None)
+
+    def drop_verdict(self, persona_id):
+        key = str(persona_id)
+        self.verdicts.pop(key, None)
+        self.prompt_hashes.pop(key, None)
+
+    def clear_verdicts(self):
+        self.verdicts = {}
+        self.prompt_hashes = {}
+
+    def feedbacks(self):
+        return list(self.verdicts.values())
+
+    def to_dict(self):
+        feedbacks = self.feedbacks()
+        return {
+            "roundNumber": self.number,
+            "imageId": self.image_id,
+            "feedbacks": feedbacks,
+            "swipeStats": {
+                "yes": sum(1 for f in feedbacks if f.get("swipe") == "right"),
+                "total": len(feedbacks),
+            },
+            "suggestions": self.suggestions,
+            "generated": self.generated,
+        }
+
+    def to_state(self):
+        return {
+            "number": self.number,
+            "imageId": self.image_id,
+            "imageHash": self.image_hash,
+            "verdicts": self.verdicts,
+            "promptHashes": self.prompt_hashes,
+            "suggestions": self.suggestions,
+            "generated": self.generated,
+        }
+
+    @classmethod
+    def from_state(cls, data):
+        round_ = cls(data["number"], data["imageId"])
+        round_.image_hash = data.get("imageHash")
+        round_.verdicts = data["verdicts"]
+        round_.prompt_hashes = data.get("promptHashes", {})
+        round_.suggestions = data["suggestions"]
+        round_.generated = data["generated"]
+        return round_
+
+
+class Session:
+    """
+    A user's run through the loop. `rounds[-1]` is the current round; earlier
+    rounds are kept as history.
+    """
+
+    def __init__(self, image_id, goal="right"):
+        self.id = uuid.uuid4().hex
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.goal = goal
+        self.rounds = [Round(1, image_id)]
+
+    @property
+    def current(self):
+        return self.rounds[-1]
+
+    def round(self, number):
+        for round_ in self.rounds:
+            if round_.number == number:
+                return round_
+        return None
+
+    def start_round(self, image_id):
+        """
+        Move on to a new image. A round with no verdicts yet is simply replaced.
+        """
+        current = self.current
+        if not current.verdicts and current.suggestions is None and not current.generated:
+            current.image_id = image_id
+            current.image_hash = None
+        else:
+            self.rounds.append(Round(current.number + 1, image_id))
+        return self.current
+
+    def to_dict(self):
+        return {
+            "sessionId": self.id,
+            "createdAt": self.created_at,
+            "updatedAt": self.updated_at,
+            "goal": self.goal,
+            "current": self.current.to_dict(),
+            "history": [r.to_dict() for r in self.rounds[:-1]],
+        }
+
+    def to_state(self):
+        return {
+            "id": self.id,
+            "createdAt": self.created_at,
+            "updatedAt": self.updated_at,
+            "goal": self.goal,
+            "rounds": [r.to_state() for r in self.rounds],
+        }
+
+    @classmethod
+    def from_state(cls, data):
+        session = cls.__new__(cls)
+        session.id = data["id"]
+        session.created_at = data["createdAt"]
+        session.updated_at = data["updatedAt"]
+        session.goal = data["goal"]
+        session.rounds = [Round.from_state(r) for r in data["rounds"]]
+        return session
+
+
+class SessionStore:
+    """
+    Sessions kept in the shared state backend with an idle TTL, so any worker
+    can serve any step of the loop. Changes go through update(), which applies
+    them atomically to the stored copy.
+    """
+
+    def __init__(self, state, ttl=SESSION_TTL):
+        self.state = state
+        self.ttl = ttl
+
+    async def create(self, image_id, goal="right"):
+        session = Session(image_id, goal)
+        await self.state.set(_NAMESPACE, session.id, session.to_state(), self.ttl)
+        return session
+
+    async def update(self, session_id, fn):
+        """
+        Apply `fn(session)` to the stored session and save it, refreshing its TTL.
+        """
+        def apply(data):
+            if data is None:
+                raise SessionNotFound(f"Session not found or expired: {session_id}")
+            session = Session.from_state(data)
+            fn(session)
+            session.updated_at = time.time()
+            return session.to_state()
+
+        return Session.from_state(await self.state.update(_NAMESPACE, session_id, apply, self.ttl))
+
+    async def get(self, session_id):
+        return await self.update(session_id, lambda session: None)
+
+    async def update_round(self, session_id, number, fn):
+        """
+        Apply `fn(round)` to round `number`, which may no longer be the current one.
+        """
+        def apply(session):
+            round_ = session.round(number)
+            if round_ is not None:
+                fn(round_)
+
+        return await self.update(session_id, apply)
+
+    async def delete(self, session_id):
+        await self.state.delete(_NAMESPACE, session_id)
+
+
+session_store = SessionStore(shared_state)
+# Decoding a stored image is the expensive part of a session request; keep recent ones
+prepared_images = MemoryCache(SESSION_IMAGE_CACHE_ENTRIES, SESSION_TTL)
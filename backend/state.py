@@ -0,0 +1,356 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Worker processes (uvicorn's own variable); more than one needs a shared state backend
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "1"))
+# Where cross-request state (sessions, jobs, shared cache tier, rate-limit buckets) lives:
+# "memory" (single process), "sqlite" (workers on one host) or "redis"
+STATE_BACKEND = (os.environ.get("STATE_BACKEND") or ("sqlite" if WEB_CONCURRENCY > 1 else "memory")).lower()
+STATE_SQLITE_PATH = os.environ.get(
+    "STATE_SQLITE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "state.sqlite3")
+)
+STATE_REDIS_URL = os.environ.get("STATE_REDIS_URL", "redis://localhost:6379/0")
+STATE_CLEANUP_INTERVAL = float(os.environ.get("STATE_CLEANUP_INTERVAL", "300"))
+
+# Idle rate-limit buckets are forgotten after this long
+_BUCKET_TTL = 3600
+
+
+def _take(tokens, updated_at, now, rate, burst, n):
+    """
+    Token bucket step shared by the backends. Returns (tokens_left, granted).
+    """
+    tokens = min(burst, tokens + max(0.0, now - updated_at) * rate)
+    granted = min(n, int(tokens))
+    return tokens - granted, granted
+
+
+def _bucket_wait(tokens, rate):
+    return max(0.0, (1 - tokens) / rate) if rate > 0 else 1.0
+
+
+class MemoryState:
+    """
+    Process-local state. Values are stored as JSON so callers get the same
+    copy semantics as with the shared backends.
+    """
+
+    shared = False
+
+    def __init__(self):
+        self._data = {}  # namespace -> OrderedDict of key -> (expires_at, json)
+        self._buckets = {}
+
+    def _space(self, namespace):
+        return self._data.setdefault(namespace, OrderedDict())
+
+    async def get(self, namespace, key):
+        entry = self._space(namespace).get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del self._space(namespace)[key]
+            return None
+        return json.loads(entry[1])
+
+    async def set(self, namespace, key, value, ttl):
+        self._space(namespace)[key] = (time.time() + ttl, json.dumps(value))
+
+    async def delete(self, namespace, key):
+        self._space(namespace).pop(key, None)
+
+    async def update(self, namespace, key, fn, ttl):
+        value = fn(await self.get(namespace, key))
+        await self.set(namespace, key, value, ttl)
+        return value
+
+    async def count(self, namespace):
+        return len(self._space(namespace))
+
+    async def trim(self, namespace, max_entries):
+        space = self._space(namespace)
+        excess = len(space) - max_entries
+        if excess <= 0:
+            return 0
+        oldest = sorted(space, key=lambda key: space[key][0])[:excess]
+        for key in oldest:
+            del space[key]
+        return excess
+
+    async def take_tokens(self, bucket, rate, burst, n):
+        now = time.time()
+        tokens, updated_at = self._buckets.get(bucket, (burst, now))
+        tokens, granted = _take(tokens, updated_at, now, rate, burst, n)
+        self._buckets[bucket] = (tokens, now)
+        return granted, _bucket_wait(tokens, rate)
+
+    async def cleanup(self):
+        now = time.time()
+        removed = 0
+        for space in self._data.values():
+            expired = [key for key, (expires_at, _) in space.items() if expires_at < now]
+            for key in expired:
+                del space[key]
+            removed += len(expired)
+        return removed
+
+    async def close(self):
+        pass
+
+
+class SQLiteState:
+    """
+    State in a SQLite file (WAL mode) shared by every worker process on the host.
+    Read-modify-write operations run in IMMEDIATE transactions, which serialize
+    writers across processes.
+    """
+
+    shared = True
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10.0)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                " namespace TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                " key TEXT PRIMARY KEY,"
+                " tokens REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+
+    def _transaction(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def _get(self, conn, namespace, key):
+        row = conn.execute(
+            "SELECT value FROM kv WHERE namespace = ? AND key = ? AND expires_at >= ?",
+            (namespace, key, time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set(self, conn, namespace, key, value, ttl):
+        conn.execute(
+            "INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, json.dumps(value), time.time() + ttl),
+        )
+
+    async def get(self, namespace, key):
+        def run():
+            with self._lock:
+                return self._get(self._conn, namespace, key)
+        return await asyncio.to_thread(run)
+
+    async def set(self, namespace, key, value, ttl):
+        def run():
+            with self._lock:
+                self._set(self._conn, namespace, key, value, ttl)
+        await asyncio.to_thread(run)
+
+    async def delete(self, namespace, key):
+        def run():
+            with self._lock:
+                self._conn.execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+        await asyncio.to_thread(run)
+
+    async def update(self, namespace, key, fn, ttl):
+        def run(conn):
+            value = fn(self._get(conn, namespace, key))
+            self._set(conn, namespace, key, value, ttl)
+            return value
+        return await asyncio.to_thread(self._transaction, run)
+
+    async def count(self, namespace):
+        def run():
+            with self._lock:
+                return self._conn.execute(
+                    "SELECT COUNT(*) FROM kv WHERE namespace = ? AND expires_at >= ?", (namespace, time.time())
+                ).fetchone()[0]
+        return await asyncio.to_thread(run)
+
+    async def trim(self, namespace, max_entries):
+        def run(conn):
+            return conn.execute(
+                "DELETE FROM kv WHERE namespace = ? AND key NOT IN"
+                " (SELECT key FROM kv WHERE namespace = ? ORDER BY expires_at DESC LIMIT ?)",
+                (namespace, namespace, max_entries),
+            ).rowcount
+        return await asyncio.to_thread(self._transaction, run)
+
+    async def take_tokens(self, bucket, rate, burst, n):
+        def run(conn):
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (bucket,)).fetchone()
+            tokens, granted = _take(*(row or (burst, now)), now, rate, burst, n)
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)", (bucket, tokens, now)
+            )
+            return granted, _bucket_wait(tokens, rate)
+        return await asyncio.to_thread(self._transaction, run)
+
+    async def cleanup(self):
+        def run(conn):
+            now = time.time()
+            removed = conn.execute("DELETE FROM kv WHERE expires_at < ?", (now,)).rowcount
+            conn.execute("DELETE FROM buckets WHERE updated_at < ?", (now - _BUCKET_TTL,))
+            return removed
+        return await asyncio.to_thread(self._transaction, run)
+
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Atomic token bucket step; the caller's clock is passed in so all workers agree on "now"
+_TAKE_TOKENS_LUA = """
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local rate, burst, n, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local granted = math.min(n, math.floor(tokens))
+tokens = tokens - granted
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[5]))
+return {granted, tostring(tokens)}
+"""
+
+
+class RedisState:
+    """
+    State in Redis (or any server speaking its protocol), for workers on one or
+    more hosts. Requires the optional `redis` package. Expiry is left to Redis.
+    """
+
+    shared = True
+
+    def __init__(self, url):
+        try:
+            import redis.asyncio as redis_asyncio
+            from redis.exceptions import WatchError
+        except ImportError as e:
+            raise RuntimeError("STATE_BACKEND=redis requires the redis package (pip install redis)") from e
+        self._redis = redis_asyncio.from_url(url, decode_responses=True)
+        self._watch_error = WatchError
+        self._take_tokens = self._redis.register_script(_TAKE_TOKENS_LUA)
+
+    @staticmethod
+    def _name(namespace, key):
+        return f"judge:{namespace}:{key}"
+
+    async def get(self, namespace, key):
+        raw = await self._redis.get(self._name(namespace, key))
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, namespace, key, value, ttl):
+        await self._redis.set(self._name(namespace, key), json.dumps(value), ex=max(1, math.ceil(ttl)))
+
+    async def delete(self, namespace, key):
+        await self._redis.delete(self._name(namespace, key))
+
+    async def update(self, namespace, key, fn, ttl):
+        name = self._name(namespace, key)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(name)
+                    raw = await pipe.get(name)
+                    value = fn(json.loads(raw) if raw is not None else None)
+                    pipe.multi()
+                    pipe.set(name, json.dumps(value), ex=max(1, math.ceil(ttl)))
+                    await pipe.execute()
+                    return value
+                except self._watch_error:
+                    # Another worker wrote the key between WATCH and EXEC; retry on the new value
+                    continue
+
+    async def count(self, namespace):
+        count = 0
+        async for _ in self._redis.scan_iter(match=self._name(namespace, "*"), count=500):
+            count += 1
+        return count
+
+    async def trim(self, namespace, max_entries):
+        """
+        Scans the namespace and drops the keys closest to expiry. Keys written
+        by other workers during the scan may survive until the next trim.
+        """
+        names = [name async for name in self._redis.scan_iter(match=self._name(namespace, "*"), count=500)]
+        excess = len(names) - max_entries
+        if excess <= 0:
+            return 0
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for name in names:
+                pipe.pttl(name)
+            ttls = await pipe.execute()
+        oldest = [name for _, name in sorted(zip(ttls, names))[:excess]]
+        return await self._redis.delete(*oldest)
+
+    async def take_tokens(self, bucket, rate, burst, n):
+        granted, tokens = await self._take_tokens(
+            keys=[self._name("bucket", bucket)], args=[rate, burst, n, time.time(), _BUCKET_TTL]
+        )
+        return int(granted), _bucket_wait(float(tokens), rate)
+
+    async def cleanup(self):
+        return 0
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+def _build_state():
+    if STATE_BACKEND == "sqlite":
+        logger.info(f"[STATE] Shared state in SQLite at {STATE_SQLITE_PATH}")
+        return SQLiteState(STATE_SQLITE_PATH)
+    if STATE_BACKEND == "redis":
+        logger.info("[STATE] Shared state in Redis")
+        return RedisState(STATE_REDIS_URL)
+    if STATE_BACKEND != "memory":
+        raise ValueError(f"Unknown STATE_BACKEND: {STATE_BACKEND}")
+    if WEB_CONCURRENCY > 1:
+        logger.warning(f"[STATE] {WEB_CONCURRENCY} workers with in-memory state: sessions, jobs and limits are per worker")
+    return MemoryState()
+
+
+async def cleanup_loop():
+    while True:
+        await asyncio.sleep(STATE_CLEANUP_INTERVAL)
+        try:
+            removed = await shared_state.cleanup()
+        except Exception as e:
+            logger.error(f"[STATE] Cleanup failed: {e}")
+            continue
+        if removed:
+            logger.info(f"[STATE] Removed {removed} expired entries")
+
+
+# Process-wide instance
+shared_state = _build_state()
@@ -0,0 +1,77 @@
+import asyncio
+
+import scheduler as scheduler_module
+from scheduler import KeyScheduler, QueueFull
+
+
+def test_cancel_after_eviction_keeps_slot_accounting():
+    async def run():
+        scheduler = KeyScheduler(rate=1000, burst=1000, max_in_flight=1, max_queue=2)
+        await scheduler.acquire("holder")
+        first = asyncio.create_task(scheduler.acquire("hog"))
+        newest = asyncio.create_task(scheduler.acquire("hog"))
+        await asyncio.sleep(0)
+
+        # A full queue pushes out the hog's newest call; it is cancelled before it resumes
+        polite = asyncio.create_task(scheduler.acquire("polite"))
+        await asyncio.sleep(0)
+        newest.cancel()
+        await asyncio.gather(newest, return_exceptions=True)
+
+        assert scheduler.in_flight == 1
+        assert scheduler.queued == 2
+        assert not first.done() and not polite.done()
+
+        scheduler.release()
+        await asyncio.sleep(0)
+        assert first.done() and not polite.done()
+        assert scheduler.in_flight == 1
+        assert scheduler.queued == 1
+
+    asyncio.run(run())
+
+
+def test_evicted_waiter_gets_queue_full():
+    async def run():
+        scheduler = KeyScheduler(rate=1000, burst=1000, max_in_flight=1, max_queue=2)
+        await scheduler.acquire("holder")
+        waiters = [asyncio.create_task(scheduler.acquire("hog")) for _ in range(2)]
+        await asyncio.sleep(0)
+        polite = asyncio.create_task(scheduler.acquire("polite"))
+        await asyncio.sleep(0)
+
+        results = await asyncio.gather(waiters[1], return_exceptions=True)
+        assert isinstance(results[0], QueueFull)
+        assert scheduler.queued == 2
+        for task in (waiters[0], polite):
+            task.cancel()
+        await asyncio.gather(waiters[0], polite, return_exceptions=True)
+        assert scheduler.queued == 0
+        assert scheduler.in_flight == 1
+
+    asyncio.run(run())
+
+
+def test_empty_client_queues_are_dropped():
+    async def run():
+        scheduler = KeyScheduler(rate=1000, burst=1000, max_in_flight=1, max_queue=8)
+        await scheduler.acquire("holder")
+        waiter = asyncio.create_task(scheduler.acquire("client"))
+        await asyncio.sleep(0)
+        assert scheduler.stats()["clientsWaiting"] == 1
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert scheduler.stats()["clientsWaiting"] == 0
+
+    asyncio.run(run())
+
+
+def test_idle_schedulers_are_evicted(monkeypatch):
+    monkeypatch.setattr(scheduler_module, "RATE_LIMIT_MAX_KEYS", 2)
+    monkeypatch.setattr(scheduler_module, "_schedulers", scheduler_module.OrderedDict())
+    busy = scheduler_module._scheduler_for("busy")
+    busy.in_flight = 1
+    for i in range(5):
+        scheduler_module._scheduler_for(f"key-{i}")
+    assert len(scheduler_module._schedulers) == 2
+    assert busy in scheduler_module._schedulers.values()
@@ -0,0 +1,78 @@
+import json
+import os
+
+from fastapi import HTTPException
+
+# Largest accepted image upload, and largest request body overall (form fields included)
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+MAX_REQUEST_BYTES = int(os.environ.get("MAX_REQUEST_BYTES", str(MAX_UPLOAD_BYTES + 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+
+def _too_large(limit):
+    return HTTPException(status_code=413, detail=f"Upload exceeds the {limit // (1024 * 1024)} MB limit")
+
+
+async def spool_upload(upload, limit=MAX_UPLOAD_BYTES):
+    """
+    Check an upload's size and return its file object rewound to the start, so
+    the image can be decoded straight from Starlette's spooled temp file without
+    reading it into memory. Uploads with no recorded size are measured in chunks.
+    """
+    size = upload.size
+    if size is None:
+        size = 0
+        await upload.seek(0)
+        while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > limit:
+                raise _too_large(limit)
+    if size > limit:
+        raise _too_large(limit)
+    await upload.seek(0)
+    return upload.file
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware rejecting request bodies over MAX_REQUEST_BYTES with a 413:
+    up front when Content-Length says so, otherwise as soon as the streamed
+    body crosses the limit, before the multipart parser spools any more of it.
+    """
+
+    def __init__(self, app, limit=MAX_REQUEST_BYTES):
+        self.app = app
+        self.limit = limit
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > self.limit:
+                await self._reject(send)
+                return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.limit:
+                    # FastAPI re-raises HTTPExceptions from body parsing, so this becomes the response
+                    raise _too_large(self.limit)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": _too_large(self.limit).detail}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
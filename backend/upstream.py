@@ -0,0 +1,346 @@
+import asyncio
+import email.utils
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from collections import OrderedDict
+
+import httpx
+
+from image_utils import PreparedImage
+from scheduler import RATE_LIMIT_MAX_KEYS, QueueFull, upstream_slot
+from metrics import UPSTREAM_RESPONSES, UPSTREAM_SECONDS, endpoint_label
+
+logger = logging.getLogger(__name__)
+
+# Overridable so benchmarks can point at a local stand-in
+OPENROUTER_URL = os.environ.get("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+
+# Retry policy for OpenRouter calls
+UPSTREAM_MAX_RETRIES = int(os.environ.get("UPSTREAM_MAX_RETRIES", "2"))
+UPSTREAM_BACKOFF_BASE = float(os.environ.get("UPSTREAM_BACKOFF_BASE", "0.5"))
+UPSTREAM_BACKOFF_MAX = float(os.environ.get("UPSTREAM_BACKOFF_MAX", "8"))
+# A Retry-After longer than this is not waited out; the error is returned instead
+UPSTREAM_MAX_RETRY_AFTER = float(os.environ.get("UPSTREAM_MAX_RETRY_AFTER", "10"))
+
+# Circuit breaker, tracked per API key
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.environ.get("BREAKER_RESET_TIMEOUT", "30"))
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    """
+    Base class for OpenRouter failures. `status_code` is what our API should return.
+    """
+    status_code = 502
+
+    def __init__(self, detail, upstream_status=None, retry_after=None):
+        super().__init__(detail)
+        self.detail = detail
+        self.upstream_status = upstream_status
+        self.retry_after = retry_after
+
+
+class UpstreamAuthError(UpstreamError):
+    status_code = 401
+
+
+class UpstreamRateLimited(UpstreamError):
+    status_code = 429
+
+
+class UpstreamTimeout(UpstreamError):
+    status_code = 504
+
+
+class UpstreamUnavailable(UpstreamError):
+    status_code = 503
+
+
+class UpstreamBadResponse(UpstreamError):
+    status_code = 502
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+class QueueFullError(UpstreamRateLimited):
+    """
+    Rejected by our own per-key admission control rather than by OpenRouter.
+    """
+
+    def __init__(self, detail, queue_position, retry_after=None):
+        super().__init__(detail, retry_after=retry_after)
+        self.queue_position = queue_position
+
+
+def _error_for_status(status, detail, retry_after=None):
+    if status in (401, 403):
+        return UpstreamAuthError(detail, status)
+    if status == 402:
+        # Out of credits: surface as an auth/billing problem with the caller's key
+        return UpstreamAuthError(detail, status)
+    if status == 429:
+        return UpstreamRateLimited(detail, status, retry_after)
+    if status in (408, 504):
+        return UpstreamTimeout(detail, status, retry_after)
+    if status is not None and status >= 500:
+        return UpstreamUnavailable(detail, status, retry_after)
+    return UpstreamBadResponse(detail, status)
+
+
+def _parse_retry_after(value):
+    """
+    Retry-After is either delay-seconds or an HTTP date.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def _backoff_delay(attempt, retry_after=None):
+    """
+    Full-jitter exponential backoff, never shorter than the server's Retry-After.
+    """
+    delay = random.uniform(0, min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class CircuitBreaker:
+    """
+    Opens after BREAKER_FAILURE_THRESHOLD consecutive upstream failures and
+    fails fast until BREAKER_RESET_TIMEOUT has passed; then lets one probe through.
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self._probing):
+            retry_after = self.reset_timeout - (time.monotonic() - self.opened_at)
+            raise CircuitOpenError(
+                "OpenRouter is failing for this API key; not sending requests for now",
+                retry_after=max(0.0, retry_after),
+            )
+        if state == "half_open":
+            self._probing = True
+
+    def abandon(self):
+        """
+        The call was cancelled before it produced an outcome.
+        """
+        self._probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def idle(self):
+        return self.failures == 0 and self.opened_at is None
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            logger.warning(f"[UPSTREAM] Circuit opened after {self.failures} consecutive failures")
+
+
+_breakers = OrderedDict()  # key id -> CircuitBreaker, least recently used first
+
+
+def _breaker_for(api_key):
+    # Never keep raw keys around as dict keys
+    key_id = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    breaker = _breakers.get(key_id)
+    if breaker is not None:
+        _breakers.move_to_end(key_id)
+        return breaker
+    breaker = _breakers[key_id] = CircuitBreaker()
+    _evict_idle_breakers()
+    return breaker
+
+
+def _evict_idle_breakers():
+    # Like the schedulers: only keys with nothing to remember (no recent failures) are forgotten
+    excess = len(_breakers) - RATE_LIMIT_MAX_KEYS
+    if excess <= 0:
+        return
+    for key_id in [key_id for key_id, breaker in _breakers.items() if breaker.idle][:excess]:
+        del _breakers[key_id]
+
+
+def breaker_states():
+    return {
+        key_id: {"state": breaker.state, "failures": breaker.failures}
+        for key_id, breaker in _breakers.items()
+    }
+
+
+class EncodedPayload:
+    """
+    A chat completion request serialized once to its JSON body, reused across
+    retries and hedged attempts.
+    """
+
+    def __init__(self, body, model):
+        self.body = body
+        self.model = model
+
+
+def encode_payload(payload):
+    """
+    Serialize a payload to JSON bytes. PreparedImage values (used as image URLs)
+    become data URIs spliced in as their pre-encoded base64 bytes, so the image
+    is copied once into the body instead of through str formatting, json.dumps
+    and a final encode.
+    """
+    if isinstance(payload, EncodedPayload):
+        return payload
+    images = []
+    marker = f"__image_{uuid.uuid4().hex}_"
+
+    def splice(value):
+        if isinstance(value, PreparedImage):
+            images.append(value)
+            return f"{marker}{len(images) - 1}"
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+    text = json.dumps(payload, default=splice, ensure_ascii=False)
+    parts = []
+    for i, image in enumerate(images):
+        head, text = text.split(f'"{marker}{i}"', 1)
+        parts += [head.encode("utf-8"), b'"', image.data_uri_prefix, image.base64, b'"']
+    parts.append(text.encode("utf-8"))
+    return EncodedPayload(b"".join(parts), payload.get("model", "unknown"))
+
+
+async def _send_once(client, api_key, payload, timeout):
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "http://localhost:3000",
+    }
+    model = payload.model
+    endpoint = endpoint_label()
+    # A bare float would replace the client's whole Timeout, connect timeout included
+    request_timeout = httpx.Timeout(timeout, connect=client.timeout.connect)
+    start = time.perf_counter()
+    try:
+        response = await asyncio.wait_for(
+            client.post(OPENROUTER_URL, headers=headers, content=payload.body, timeout=request_timeout),
+            timeout=timeout,
+        )
+    except (asyncio.TimeoutError, httpx.TimeoutException) as e:
+        UPSTREAM_RESPONSES.labels(model, endpoint, "timeout").inc()
+        raise UpstreamTimeout(f"OpenRouter API request timed out: {e}")
+    except httpx.RequestError as e:
+        UPSTREAM_RESPONSES.labels(model, endpoint, "error").inc()
+        raise UpstreamUnavailable(f"OpenRouter API request failed: {e}")
+    UPSTREAM_SECONDS.labels(model, endpoint).observe(time.perf_counter() - start)
+    UPSTREAM_RESPONSES.labels(model, endpoint, str(response.status_code)).inc()
+
+    retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+    try:
+        result = response.json()
+    except ValueError:
+        raise _error_for_status(
+            response.status_code if response.status_code >= 400 else None,
+            f"OpenRouter returned a non-JSON response (status {response.status_code})",
+            retry_after,
+        )
+
+    # OpenRouter can report errors with a 200 status and an `error` body
+    error = result.get("error") if isinstance(result, dict) else None
+    if response.status_code >= 400 or error:
+        status = response.status_code
+        if status < 400 and isinstance(error, dict) and isinstance(error.get("code"), int):
+            status = error["code"]
+        message = error.get("message", error) if isinstance(error, dict) else (error or response.text[:200])
+        raise _error_for_status(status, f"OpenRouter API error ({status}): {message}", retry_after)
+
+    if not isinstance(result, dict) or not result.get("choices"):
+        raise UpstreamBadResponse(f"Unexpected API response format: {str(result)[:200]}")
+    return result, response.status_code
+
+
+async def post_chat_completion(client, api_key, payload, timeout, tag="UPSTREAM", on_admitted=None):
+    """
+    POST a chat completion with status-aware retries, jittered backoff honoring
+    Retry-After, a per-key circuit breaker and per-key admission control (each
+    attempt takes a scheduler slot). Returns the parsed JSON body or raises an
+    UpstreamError subclass. `payload` is a dict or an EncodedPayload.
+    `on_admitted()` is called each time an attempt gets its scheduler slot.
+    """
+    payload = encode_payload(payload)
+    breaker = _breaker_for(api_key)
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            async with upstream_slot(api_key):
+                if on_admitted is not None:
+                    on_admitted()
+                result, status = await _send_once(client, api_key, payload, timeout)
+        except QueueFull as e:
+            breaker.abandon()
+            logger.warning(f"[{tag}] {e}")
+            raise QueueFullError(str(e), e.queue_position, e.retry_after)
+        except asyncio.CancelledError:
+            breaker.abandon()
+            raise
+        except UpstreamError as e:
+            retryable = isinstance(e, (UpstreamTimeout, UpstreamUnavailable, UpstreamRateLimited)) and (
+                e.upstream_status is None or e.upstream_status in RETRYABLE_STATUS
+            )
+            if retryable and not isinstance(e, UpstreamRateLimited):
+                breaker.record_failure()
+            else:
+                # The upstream answered; this request (or the key's quota) was the problem
+                breaker.record_success()
+            if not retryable or attempt >= UPSTREAM_MAX_RETRIES:
+                logger.error(f"[{tag}] Giving up after {attempt + 1} attempt(s): {e}")
+                raise
+            if e.retry_after is not None and e.retry_after > UPSTREAM_MAX_RETRY_AFTER:
+                logger.error(f"[{tag}] Retry-After {e.retry_after:.1f}s exceeds limit, not retrying: {e}")
+                raise
+            delay = _backoff_delay(attempt, e.retry_after)
+            logger.warning(f"[{tag}] Attempt {attempt + 1} failed ({e}); retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        breaker.record_success()
+        logger.debug(f"[{tag}] Response Status: {status}", extra={"status": status})
+        return result
@@ -18,12 +18,17 @@ function App() {
     roundNumber: 1,
     image: null,
     imageFile: null,
+    imageId: null,
+    inSession: false,
     feedbacks: [],
     swipeStats: { yes: 0, total: 0 },
     suggestions: { thinking: '', prompt: '' },
     newImages: []
   });
 
+  // Server-side session holding the current image, verdicts and suggestions
+  const [sessionId, setSessionId] = useState(null);
+
   // Custom personas list (starts with default + custom ones)
   const [personas, setPersonas] = useState(personasData);
 
@@ -51,10 +56,14 @@ function App() {
   }, [roundsHistory.length]);
 
   const handleImageUpload = (file) => {
+    // A fresh upload starts a new session
+    setSessionId(null);
     setCurrentRound(prev => ({
       ...prev,
       image: URL.createObjectURL(file),
       imageFile: file,
+      imageId: null,
+      inSession: false,
       feedbacks: [],
       swipeStats: { yes: 0, total: 0 },
       suggestions: { thinking: '', prompt: '' },
@@ -76,8 +85,36 @@ function App() {
     setSelectedJudges([...selectedJudges, newJudge.id]);
   };
 
+  // Register the current image with the backend session once; later calls only send the session id
+  const ensureSession = async () => {
+    if (sessionId && currentRound.inSession) return sessionId;
+
+    const formData = new FormData();
+    if (currentRound.imageId) {
+      formData.append('imageId', currentRound.imageId);
+    } else {
+      formData.append('image', currentRound.imageFile);
+    }
+    let url = `${API_URL}/sessions`;
+    if (sessionId) {
+      url = `${API_URL}/sessions/${sessionId}/rounds`;
+    } else {
+      formData.append('goal', swipeGoal);
+    }
+
+    const res = await fetch(url, { method: 'POST', body: formData });
+    if (!res.ok) {
+      const errorData = await res.json().catch(() => ({}));
+      throw new Error(`Session API error ${res.status}: ${errorData.detail || 'Unknown error'}`);
+    }
+    const data = await res.json();
+    setSessionId(data.sessionId);
+    setCurrentRound(prev => ({ ...prev, imageId: data.current.imageId, inSession: true }));
+    return data.sessionId;
+  };
+
   const handleAskGirls = async () => {
-    if (!currentRound.imageFile || selectedJudges.length === 0) return;
+    if ((!currentRound.imageFile && !currentRound.imageId) || selectedJudges.length === 0) return;
 
     setLoading(true);
     setCurrentRound(prev => ({
@@ -89,52 +126,73 @@ function App() {
     // Get selected personas by their IDs
     const selectedPersonas = personas.filter(p => selectedJudges.includes(p.id));
 
-    const promises = selectedPersonas.map(async (persona) => {
-      const formData = new FormData();
-      formData.append('openRouterKey', openRouterKey);
-      formData.append('persona', JSON.stringify(persona));
-      formData.append('image', currentRound.imageFile);
-
-      try {
-        const res = await fetch(`${API_URL}/evaluate`, {
-          method: 'POST',
-          body: formData
-        });
-
-        // Check for HTTP errors
-        if (!res.ok) {
-          const errorData = await res.json().catch(() => ({}));
-          console.error(`API error ${res.status}:`, errorData.detail || 'Unknown error');
-          return null;
-        }
-
-        const data = await res.json();
-        return {
-          personaId: persona.id,
-          content: data.content || data.reason || '',
-          reason: data.reason || '',
-          likes: data.likes || '',
-          dislikes: data.dislikes || '',
-          keep: data.keep || '',
-          change: data.change || '',
-          isSwipeRight: data.swipe === "right"
-        };
-      } catch (err) {
-        console.error(err);
-        return null;
-      }
+    // The image lives in the session; the backend streams each verdict as it lands
+    const formData = new FormData();
+    formData.append('openRouterKey', openRouterKey);
+    // Built-in judges go by id; only custom ones carry their own name and bio
+    formData.append('personas', JSON.stringify(selectedPersonas.map(p => (
+      p.isCustom ? { id: p.id, name: p.name, bio: p.bio, isCustom: true } : p.id
+    ))));
+
+    const toFeedback = (r) => ({
+      personaId: r.personaId,
+      content: r.content || r.reason || '',
+      reason: r.reason || '',
+      likes: r.likes || '',
+      dislikes: r.dislikes || '',
+      keep: r.keep || '',
+      change: r.change || '',
+      isSwipeRight: r.swipe === "right",
+      carriedOver: Boolean(r.carriedOver)
     });
 
-    const results = await Promise.all(promises);
-    const validResults = results.filter(r => r !== null);
+    const handleEvent = (event, data) => {
+      if (event === 'verdict') {
+        setCurrentRound(prev => ({
+          ...prev,
+          feedbacks: [...prev.feedbacks, toFeedback(data.result)],
+          swipeStats: { yes: data.swipeStats.yes, total: data.swipeStats.total }
+        }));
+      } else if (event === 'error') {
+        console.error(`Persona ${data.personaId} failed:`, data.detail);
+      }
+    };
 
-    const yesCount = validResults.filter(r => r.isSwipeRight).length;
+    try {
+      // Whether later rounds only re-ask judges whose verdict may have changed
+      // is up to the server (INCREMENTAL_EVALUATION)
+      formData.append('sessionId', await ensureSession());
+      const res = await fetch(`${API_URL}/evaluate/stream`, {
+        method: 'POST',
+        body: formData
+      });
 
-    setCurrentRound(prev => ({
-      ...prev,
-      feedbacks: validResults,
-      swipeStats: { yes: yesCount, total: validResults.length }
-    }));
+      // Check for HTTP errors
+      if (!res.ok) {
+        const errorData = await res.json().catch(() => ({}));
+        console.error(`API error ${res.status}:`, errorData.detail || 'Unknown error');
+      } else {
+        // Minimal SSE parser: events are separated by a blank line
+        const reader = res.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          let sep;
+          while ((sep = buffer.indexOf('\n\n')) !== -1) {
+            const chunk = buffer.slice(0, sep);
+            buffer = buffer.slice(sep + 2);
+            const event = chunk.match(/^event: (.*)$/m)?.[1];
+            const data = chunk.match(/^data: (.*)$/m)?.[1];
+            if (event && data) handleEvent(event, JSON.parse(data));
+          }
+        }
+      }
+    } catch (err) {
+      console.error(err);
+    }
 
     setLoading(false);
   };
@@ -147,17 +205,11 @@ function App() {
       const res = await fetch(`${API_URL}/combine`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
+        // The backend already holds this round's verdicts
         body: JSON.stringify({
           openRouterKey,
           goal: swipeGoal,
-          feedbacks: currentRound.feedbacks.map(f => ({
-            name: personas.find(p => p.id === f.personaId)?.name || 'Unknown',
-            content: f.content,
-            likes: f.likes || '',
-            dislikes: f.dislikes || '',
-            keep: f.keep || '',
-            change: f.change || ''
-          }))
+          sessionId
         })
       });
 
@@ -197,12 +249,11 @@ function App() {
       formData.append('suggestions', suggestionText);
       formData.append('count', generateCount.toString());
 
-      // Include original image for reference
-      if (currentRound.imageFile) {
-        formData.append('originalImage', currentRound.imageFile);
-      }
+      // The session supplies the original image for reference
+      formData.append('sessionId', await ensureSession());
 
-      const res = await fetch(`${API_URL}/generate`, {
+      // Submit a background job, then follow its progress over SSE
+      const res = await fetch(`${API_URL}/generate/jobs`, {
         method: 'POST',
         body: formData
       });
@@ -214,11 +265,36 @@ function App() {
         return;
       }
 
-      const data = await res.json();
-      setCurrentRound(prev => ({
-        ...prev,
-        newImages: data.images || []
-      }));
+      const { jobId } = await res.json();
+      setCurrentRound(prev => ({ ...prev, newImages: [] }));
+
+      await new Promise((resolve) => {
+        const source = new EventSource(`${API_URL}/generate/jobs/${jobId}/events`);
+        const addImage = (url) => setCurrentRound(prev => (
+          prev.newImages.includes(url) ? prev : { ...prev, newImages: [...prev.newImages, url] }
+        ));
+        const finish = () => {
+          source.close();
+          resolve();
+        };
+
+        source.addEventListener('snapshot', (e) => {
+          JSON.parse(e.data).progress.forEach(p => addImage(p.image));
+        });
+        source.addEventListener('progress', (e) => addImage(JSON.parse(e.data).image));
+        source.addEventListener('done', (e) => {
+          (JSON.parse(e.data).result?.images || []).forEach(addImage);
+          finish();
+        });
+        source.addEventListener('failed', (e) => {
+          console.error('Generate job failed:', JSON.parse(e.data).error?.detail || 'Unknown error');
+          finish();
+        });
+        source.onerror = (err) => {
+          console.error('Generate job stream error', err);
+          finish();
+        };
+      });
     } catch (err) {
       console.error(err);
     } finally {
@@ -230,14 +306,18 @@ function App() {
     // Save current round to history
     setRoundsHistory(prev => [...prev, { ...currentRound }]);
 
-    // Convert image URL to File object for the next round
+    // Generated images are stored server-side; reference them by id instead of re-uploading
+    const blobMatch = imgUrl.match(/\/api\/blobs\/([^/?#]+)$/);
+    const newImageId = blobMatch ? blobMatch[1] : null;
     let newImageFile = null;
-    try {
-      const res = await fetch(imgUrl);
-      const blob = await res.blob();
-      newImageFile = new File([blob], `round_${currentRound.roundNumber + 1}.jpg`, { type: "image/jpeg" });
-    } catch (err) {
-      console.error("Error converting selected image to file", err);
+    if (!newImageId) {
+      try {
+        const res = await fetch(imgUrl);
+        const blob = await res.blob();
+        newImageFile = new File([blob], `round_${currentRound.roundNumber + 1}.jpg`, { type: "image/jpeg" });
+      } catch (err) {
+        console.error("Error converting selected image to file", err);
+      }
     }
 
     // Start new round with the selected image
@@ -245,6 +325,8 @@ function App() {
       roundNumber: currentRound.roundNumber + 1,
       image: imgUrl,
       imageFile: newImageFile,
+      imageId: newImageId,
+      inSession: false,
       feedbacks: [],
       swipeStats: { yes: 0, total: 0 },
       suggestions: { thinking: '', prompt: '' },